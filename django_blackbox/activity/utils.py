@@ -1,10 +1,40 @@
 """
 Utility functions for activity logging.
 """
-import json
+import weakref
+from dataclasses import dataclass, field
 from typing import Any
 
-from django.forms.models import model_to_dict
+from django_blackbox import jsonutils
+
+# Model class -> ((name, attname), ...) for its editable concrete fields
+_field_names_cache: "weakref.WeakKeyDictionary[type, tuple[tuple[str, str], ...]]" = weakref.WeakKeyDictionary()
+
+
+def model_field_values(instance: Any) -> dict:
+    """
+    Read a model instance's editable concrete field values without queries.
+    
+    Like model_to_dict(), but values come straight from the instance __dict__:
+    many-to-many fields are skipped (reading them runs a query), foreign keys
+    give the raw ID, and deferred fields are left out rather than loaded.
+    
+    Args:
+        instance: A Django model instance.
+        
+    Returns:
+        dict: Field name to value.
+    """
+    model = type(instance)
+    fields = _field_names_cache.get(model)
+    if fields is None:
+        fields = tuple(
+            (f.name, f.attname) for f in instance._meta.concrete_fields if f.editable
+        )
+        _field_names_cache[model] = fields
+    
+    values = instance.__dict__
+    return {name: values[attname] for name, attname in fields if attname in values}
 
 
 def normalize_instance(instance: Any) -> dict:
@@ -24,16 +54,16 @@ def normalize_instance(instance: Any) -> dict:
     if isinstance(instance, dict):
         # Try to serialize to ensure it's valid JSON
         try:
-            json.dumps(instance)
+            jsonutils.dumps_bytes(instance)
             return instance
         except (TypeError, ValueError):
             # If not JSON-serializable, convert values
             return {k: str(v) for k, v in instance.items()}
     
-    # If it's a Django model instance, use model_to_dict
+    # If it's a Django model instance, read its concrete field values
     if hasattr(instance, "_meta"):
         try:
-            return model_to_dict(instance)
+            return model_field_values(instance)
         except Exception:
             # Fallback: convert to string representation
             return {"__str__": str(instance)}
@@ -63,22 +93,59 @@ def compute_diff(instance_before: dict, instance_after: dict) -> dict:
     Returns:
         dict: A dictionary mapping field names to [old_value, new_value] tuples.
     """
-    diff = {}
+    if instance_before is instance_after or instance_before == instance_after:
+        return {}
     
-    # Find changed fields
-    all_keys = set(instance_before.keys()) | set(instance_after.keys())
+    diff = {}
     
-    for key in all_keys:
-        old_val = instance_before.get(key)
+    # A key missing on one side compares as None, so {"x": None} vs {} is unchanged
+    for key, old_val in instance_before.items():
         new_val = instance_after.get(key)
-        
-        # Compare values (handle None and empty dict/list)
         if old_val != new_val:
             diff[key] = [old_val, new_val]
     
+    for key, new_val in instance_after.items():
+        if new_val is not None and key not in instance_before:
+            diff[key] = [None, new_val]
+    
     return diff
 
 
+@dataclass(slots=True)
+class ActivityChangeCtx:
+    """
+    Change details attached to a request by set_request_activity_change().
+    
+    Read by ActivityLoggingMiddleware. Supports ``ctx["key"]`` and
+    ``ctx.get("key", default)`` like the plain dict it replaces.
+    """
+
+    # None = not set, so the middleware falls back to its method-based mapping
+    action: str | None = None
+    custom_action: str = ""
+    custom_payload: dict = field(default_factory=dict)
+    instance_before: dict = field(default_factory=dict)
+    instance_after: dict = field(default_factory=dict)
+    # None = not computed yet: the middleware diffs before/after when it
+    # writes the row (in the background writer with ACTIVITY_LOG_ASYNC)
+    instance_diff: dict | None = None
+
+    def __getitem__(self, key: str) -> Any:
+        """Dict-style access to a field."""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: object) -> bool:
+        """Whether key names a field."""
+        return key in self.__slots__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Dict-style access to a field, with a default for unknown keys."""
+        return getattr(self, key, default)
+
+
 def set_request_activity_change(
     request: Any,
     *,
@@ -104,18 +171,14 @@ def set_request_activity_change(
     before_dict = normalize_instance(instance_before) if instance_before is not None else {}
     after_dict = normalize_instance(instance_after) if instance_after is not None else {}
     
-    # Compute diff
-    instance_diff = compute_diff(before_dict, after_dict) if before_dict or after_dict else {}
-    
     # Store context on request
     # Use None for action if not provided, so middleware can distinguish between
     # "not set" (None) and "explicitly set to empty" ("")
-    request._activity_change_context = {
-        "action": action,  # Keep None if not provided, so middleware can use default mapping
-        "custom_action": custom_action or "",
-        "custom_payload": custom_payload or {},
-        "instance_before": before_dict,
-        "instance_after": after_dict,
-        "instance_diff": instance_diff,
-    }
+    request._activity_change_context = ActivityChangeCtx(
+        action=action,
+        custom_action=custom_action or "",
+        custom_payload=custom_payload or {},
+        instance_before=before_dict,
+        instance_after=after_dict,
+    )
 
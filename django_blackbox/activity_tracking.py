@@ -11,9 +11,10 @@ import logging
 from typing import Any, Dict, Optional, Tuple
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_migrate, post_save, pre_save
 from django.dispatch import receiver
-from django.forms.models import model_to_dict
+
+from django_blackbox.activity.utils import model_field_values
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +68,7 @@ def _instance_to_dict(instance: Any) -> Dict[str, Any]:
     """
     Convert model instance to a JSON-serializable dict (best-effort).
     
-    Uses model_to_dict when possible, falls back to attribute iteration
+    Uses model_field_values when possible, falls back to attribute iteration
     for edge cases. All values are sanitized to ensure JSON-serializability.
     
     Args:
@@ -82,7 +83,7 @@ def _instance_to_dict(instance: Any) -> Dict[str, Any]:
         return {}
     
     try:
-        data = model_to_dict(instance)
+        data = model_field_values(instance)
     except Exception:
         # Fallback: manual attribute extraction
         data: Dict[str, Any] = {}
@@ -139,18 +140,53 @@ def _compute_diff(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Di
         Dictionary mapping field names to {"before": value, "after": value}
         for fields that changed
     """
+    if before is after or before == after:
+        return {}
+    
     diff: Dict[str, Dict[str, Any]] = {}
-    keys = set(before.keys()) | set(after.keys())
     
-    for key in keys:
-        b = before.get(key)
+    # A key missing on one side compares as None
+    for key, b in before.items():
         a = after.get(key)
         if b != a:
             diff[key] = {"before": b, "after": a}
     
+    for key, a in after.items():
+        if a is not None and key not in before:
+            diff[key] = {"before": None, "after": a}
+    
     return diff
 
 
+# Model class -> ContentType, filled on first use. Unlike
+# ContentType.objects.get_for_model(), a hit is one dict lookup with no
+# router call; cleared after migrate/flush, which can recreate the rows.
+_content_type_cache: Dict[type, ContentType] = {}
+
+
+def content_type_for(model: type) -> ContentType:
+    """
+    Get the ContentType for a model class, cached per process.
+    
+    Args:
+        model: Django model class
+        
+    Returns:
+        The model's ContentType
+    """
+    content_type = _content_type_cache.get(model)
+    if content_type is None:
+        content_type = ContentType.objects.get_for_model(model)
+        _content_type_cache[model] = content_type
+    return content_type
+
+
+@receiver(post_migrate)
+def _clear_content_type_cache(sender, **kwargs):
+    """Drop cached ContentTypes; migrate and flush can recreate their rows."""
+    _content_type_cache.clear()
+
+
 def get_tracked_change_for(
     content_type: Optional[ContentType], object_id: str
 ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
@@ -169,20 +169,20 @@ class IncidentAdmin(admin.ModelAdmin):
 
     def mark_acknowledged(self, request, queryset):
         """Mark selected incidents as acknowledged."""
-        queryset.update(status=Incident.Status.ACKNOWLEDGED)
+        # Clear resolved_at like Incident.save() does when leaving RESOLVED
+        queryset.update(status=Incident.Status.ACKNOWLEDGED, resolved_at=None)
 
     mark_acknowledged.short_description = "Mark as Acknowledged"
 
     def mark_resolved(self, request, queryset):
         """Mark selected incidents as resolved."""
-        from django.utils import timezone
-        queryset.update(status=Incident.Status.RESOLVED)
+        Incident.objects.bulk_resolve(queryset.values("pk"))
 
     mark_resolved.short_description = "Mark as Resolved"
 
     def mark_suppressed(self, request, queryset):
         """Mark selected incidents as suppressed."""
-        queryset.update(status=Incident.Status.SUPPRESSED)
+        queryset.update(status=Incident.Status.SUPPRESSED, resolved_at=None)
 
     mark_suppressed.short_description = "Mark as Suppressed"
 
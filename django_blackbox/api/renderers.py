@@ -0,0 +1,38 @@
+"""
+Renderers for the read-only API.
+"""
+from rest_framework.renderers import JSONRenderer
+
+from django_blackbox.jsonutils import HAS_ORJSON, orjson
+
+if HAS_ORJSON:
+    # Datetimes, UUIDs etc. go through DRF's encoder so output matches JSONRenderer
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class OrjsonJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that serializes with orjson when it is installed.
+    
+    Falls back to JSONRenderer when orjson is missing, when indented output
+    is requested (e.g. by the browsable API) or when ASCII-only output is
+    configured via UNICODE_JSON = False.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render data into JSON, returning a bytestring.
+        """
+        if not HAS_ORJSON or data is None or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        # Match JSONRenderer: escape U+2028/U+2029 so the output is a JavaScript subset
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
@@ -7,11 +7,16 @@ from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from django_blackbox.models import Incident, RequestActivity
 from .permissions import DEFAULT_PERMISSION_CLASS
+from .renderers import OrjsonJSONRenderer
 from .serializers import IncidentSerializer, RequestActivitySerializer
 
+# orjson-backed JSON first; the project's renderers (browsable API etc.) still apply
+RENDERER_CLASSES = [OrjsonJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+
 
 class IncidentViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -25,6 +30,7 @@ class IncidentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Incident.objects.all()
     serializer_class = IncidentSerializer    
     permission_classes = DEFAULT_PERMISSION_CLASS
+    renderer_classes = RENDERER_CLASSES
     lookup_field = "request_id"  # Use incident_id instead of pk for lookups
 
     @action(detail=True, methods=["get"])
@@ -153,9 +159,10 @@ class RequestActivityViewSet(viewsets.ReadOnlyModelViewSet):
     - GET /api/activities/{id}/          - Retrieve a specific activity
     """
     
-    queryset = RequestActivity.objects.all()
+    queryset = RequestActivity.objects.with_related()
     serializer_class = RequestActivitySerializer
     permission_classes = DEFAULT_PERMISSION_CLASS
+    renderer_classes = RENDERER_CLASSES
     filterset_fields = [
         "method",
         "http_status",
@@ -10,6 +10,15 @@ class DjangoBlackboxConfig(AppConfig):
 
     def ready(self):
         """Register signal handlers when app is ready."""
+        from django.core.signals import setting_changed
+
+        from .conf import _on_setting_changed
+        from .utils import _on_setting_changed as _on_setting_changed_utils
+
         # Import activity tracking to register signal handlers
         from . import activity_tracking  # noqa: F401
 
+        # Keep the cached Config in sync with override_settings()
+        setting_changed.connect(_on_setting_changed, dispatch_uid="django_blackbox_conf_reset")
+        setting_changed.connect(_on_setting_changed_utils, dispatch_uid="django_blackbox_utils_reset")
+
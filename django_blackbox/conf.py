@@ -5,9 +5,25 @@ Reads DJANGO_BLACKBOX dict from Django settings with sane defaults.
 import re
 from collections import ChainMap
 from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Any
 
 
+def _combine_patterns(patterns: list[str]) -> re.Pattern | None:
+    """
+    Fuse regex patterns into one alternation so a path is tested in one search.
+    
+    Args:
+        patterns: Regex pattern strings.
+    
+    Returns:
+        re.Pattern | None: The combined pattern, or None if there are no patterns.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
 @dataclass
 class Config:
     """Configuration dataclass with defaults."""
@@ -19,6 +35,8 @@ class Config:
     GENERIC_ERROR_MESSAGE: str = "Something broke on our side. We've logged it. Share the Incident ID with support."
     INCLUDE_INCIDENT_ID_IN_BODY: bool = True
     CAPTURE_STACKTRACE: bool = True
+    # Format at most this many frames per stacktrace (None = all)
+    MAX_STACK_FRAMES: int | None = None
     CAPTURE_RESPONSE_5XX: bool = True
     CAPTURE_EXCEPTIONS: bool = True
     # Status codes to capture incidents for (supports ranges and individual codes)
@@ -55,6 +73,12 @@ class Config:
     USER_RESOLUTION_CALLABLE: str | None = None
     RETENTION_DAYS: int = 90
     DEDUP_WINDOW_SECONDS: int = 300
+    # Coalesce repeated hits of one signature in-process for this many seconds
+    # (0 disables); counts are written in one UPDATE when the window closes.
+    DEDUP_COALESCE_SECONDS: float = 0
+    DEDUP_COALESCE_MAX_ENTRIES: int = 1024
+    # Digest used for dedup signatures: "blake2b" (128-bit) or "sha256"
+    SIGNATURE_HASH: str = "blake2b"
     FALLBACK_FILE_LOG: bool = True
     FALLBACK_FILE_PATH: str = "server_incidents_fallback.log"
     RETURN_ORIGINAL_500_STATUS: bool = True
@@ -67,15 +91,49 @@ class Config:
     ACTIVITY_LOG_IGNORE_PATHS: list[str] = field(default_factory=lambda: [])
     STORE_RESPONSE_BODY: bool = True  # Default to True to log response bodies
     MAX_RESPONSE_BODY_BYTES: int = 1024
-    _compiled_ignore_paths: list[Any] = field(default_factory=list, init=False, repr=False)
-    _compiled_ignore_exceptions: list[Any] = field(default_factory=list, init=False, repr=False)
-    _compiled_activity_ignore_paths: list[Any] = field(default_factory=list, init=False, repr=False)
+    # Write RequestActivity rows from a background thread in batches
+    ACTIVITY_LOG_ASYNC: bool = False
+    ACTIVITY_LOG_QUEUE_SIZE: int = 10000
+    ACTIVITY_LOG_FLUSH_INTERVAL_MS: int = 1000
+    ACTIVITY_LOG_FLUSH_BATCH: int = 100
+    _compiled_ignore_exceptions: tuple[str, ...] = field(default=(), init=False, repr=False)
+    _capture_status_codes: frozenset[int] = field(default=frozenset(), init=False, repr=False)
+    _capture_status_ranges: tuple[tuple[int, int], ...] = field(default=(), init=False, repr=False)
+    _custom_error_has_placeholder: bool = field(default=False, init=False, repr=False)
 
     def __post_init__(self):
-        """Compile regex patterns for ignore paths."""
-        self._compiled_ignore_paths = [re.compile(p) for p in self.IGNORE_PATHS]
-        self._compiled_ignore_exceptions = self.IGNORE_EXCEPTIONS
-        self._compiled_activity_ignore_paths = [re.compile(p) for p in self.ACTIVITY_LOG_IGNORE_PATHS]
+        """Precompute derived lookups and flags."""
+        # str.startswith() accepts a tuple of prefixes
+        self._compiled_ignore_exceptions = tuple(self.IGNORE_EXCEPTIONS)
+        self._capture_status_codes = frozenset(
+            rule for rule in self.CAPTURE_STATUS_CODES if isinstance(rule, int)
+        )
+        self._capture_status_ranges = tuple(
+            rule for rule in self.CAPTURE_STATUS_CODES if isinstance(rule, tuple)
+        )
+        self._custom_error_has_placeholder = bool(self.CUSTOM_ERROR_FORMAT) and any(
+            isinstance(v, str) and "<incident_id>" in v for v in self.CUSTOM_ERROR_FORMAT.values()
+        )
+
+    @cached_property
+    def ignore_paths_re(self) -> re.Pattern | None:
+        """IGNORE_PATHS fused into one compiled regex (None if empty)."""
+        return _combine_patterns(self.IGNORE_PATHS)
+
+    @cached_property
+    def activity_ignore_paths_re(self) -> re.Pattern | None:
+        """ACTIVITY_LOG_IGNORE_PATHS fused into one compiled regex (None if empty)."""
+        return _combine_patterns(self.ACTIVITY_LOG_IGNORE_PATHS)
+
+    @cached_property
+    def redact_headers_set(self) -> frozenset[str]:
+        """REDACT_HEADERS casefolded into a frozenset, built once per config."""
+        return frozenset(h.casefold() for h in self.REDACT_HEADERS)
+
+    @cached_property
+    def redact_fields_set(self) -> frozenset[str]:
+        """REDACT_FIELDS casefolded into a frozenset, built once per config."""
+        return frozenset(f.casefold() for f in self.REDACT_FIELDS)
 
 
 _config: Config | None = None
@@ -112,6 +170,7 @@ def _reload_config():
         "GENERIC_ERROR_MESSAGE": "Something broke on our side. We've logged it. Share the Incident ID with support.",
         "INCLUDE_INCIDENT_ID_IN_BODY": True,
         "CAPTURE_STACKTRACE": True,
+        "MAX_STACK_FRAMES": None,
         "CAPTURE_RESPONSE_5XX": True,
         "CAPTURE_EXCEPTIONS": True,
         "CAPTURE_STATUS_CODES": [(500, 599)],
@@ -131,6 +190,9 @@ def _reload_config():
         "USER_RESOLUTION_CALLABLE": None,
         "RETENTION_DAYS": 90,
         "DEDUP_WINDOW_SECONDS": 300,
+        "DEDUP_COALESCE_SECONDS": 0,
+        "DEDUP_COALESCE_MAX_ENTRIES": 1024,
+        "SIGNATURE_HASH": "blake2b",
         "FALLBACK_FILE_LOG": True,
         "FALLBACK_FILE_PATH": "server_incidents_fallback.log",
         "RETURN_ORIGINAL_500_STATUS": True,
@@ -142,6 +204,10 @@ def _reload_config():
         "ACTIVITY_LOG_IGNORE_PATHS": [],
         "STORE_RESPONSE_BODY": True,  # Default to True to log response bodies
         "MAX_RESPONSE_BODY_BYTES": 1024,
+        "ACTIVITY_LOG_ASYNC": False,
+        "ACTIVITY_LOG_QUEUE_SIZE": 10000,
+        "ACTIVITY_LOG_FLUSH_INTERVAL_MS": 1000,
+        "ACTIVITY_LOG_FLUSH_BATCH": 100,
     }
     
     config_dict = {**defaults, **user_settings}
@@ -153,3 +219,9 @@ def reset_config():
     global _config
     _config = None
 
+
+def _on_setting_changed(setting: str, **kwargs: Any) -> None:
+    """Drop the cached configuration when DJANGO_BLACKBOX is overridden."""
+    if setting == "DJANGO_BLACKBOX":
+        reset_config()
+
@@ -0,0 +1,74 @@
+"""
+Model fields for django_blackbox.
+"""
+from django.conf import settings
+from django.db import models
+from django.db.models.fields.json import KeyTransform
+
+from django_blackbox import jsonutils
+
+
+class JSONField(models.JSONField):
+    """
+    JSONField that encodes and decodes with orjson when it is installed.
+    
+    Decoding always goes through jsonutils.loads unless a custom decoder is
+    set. Saved dicts and lists are encoded with jsonutils.dumps unless a custom
+    encoder is set or the database is PostgreSQL, where the driver's jsonb
+    adapter is kept. Without orjson this behaves like models.JSONField.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or self.decoder is not None:
+            return super().from_db_value(value, expression, connection)
+        # Some backends (SQLite at least) extract non-string values in their
+        # SQL datatypes.
+        if isinstance(expression, KeyTransform) and not isinstance(value, str):
+            return value
+        try:
+            return jsonutils.loads(value)
+        except ValueError:
+            return value
+
+    def get_db_prep_save(self, value, connection):
+        if (
+            jsonutils.HAS_ORJSON
+            and self.encoder is None
+            and isinstance(value, (dict, list))
+            and connection.vendor != "postgresql"
+        ):
+            return jsonutils.dumps(value)
+        return super().get_db_prep_save(value, connection)
+
+
+def tags_field() -> models.Field:
+    """
+    Build the Incident.tags field for the default database.
+    
+    ArrayField (and its psycopg dependency) is only imported when the default
+    database is Postgres; other backends store tags in a CharField. Migration
+    0001 builds the field with this function too, so the migration state
+    matches the model on every engine.
+    
+    Returns:
+        models.Field: The field instance to use for tags.
+    """
+    engine = settings.DATABASES.get("default", {}).get("ENGINE", "")
+    if "postgresql" in engine or "postgis" in engine:
+        try:
+            from django.contrib.postgres.fields import ArrayField
+        except ImportError:
+            # Postgres driver not installed
+            pass
+        else:
+            return ArrayField(
+                models.CharField(max_length=100),
+                default=list,
+                blank=True,
+                size=None,
+            )
+    return models.CharField(
+        max_length=1024,
+        blank=True,
+        default="",
+    )
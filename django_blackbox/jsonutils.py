@@ -0,0 +1,100 @@
+"""
+JSON encode/decode helpers with an optional orjson fast path.
+
+orjson is used when it is installed (``pip install django-blackbox[orjson]``);
+otherwise the standard library json module is used. Output is compact and
+keeps non-ASCII characters in both cases. This module has no Django imports
+so it can be used from settings, fields and middleware alike.
+"""
+import json
+from typing import Any, Callable, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if HAS_ORJSON else 0
+
+
+def loads(data: str | bytes | bytearray | memoryview) -> Any:
+    """
+    Decode a JSON document.
+    
+    Args:
+        data: JSON text as str or bytes
+    
+    Returns:
+        The decoded Python object
+    
+    Raises:
+        ValueError: If data is not valid JSON (json.JSONDecodeError and
+            orjson.JSONDecodeError both subclass ValueError)
+    """
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+    """
+    Encode an object as compact UTF-8 JSON bytes.
+    
+    Args:
+        obj: Object to encode
+        default: Called for objects the encoder cannot serialize natively
+    
+    Returns:
+        bytes: UTF-8 encoded JSON
+    
+    Raises:
+        TypeError: If obj contains a value that cannot be serialized
+    """
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits; the stdlib handles those
+            pass
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+    """
+    Encode an object as a compact JSON string.
+    
+    Args:
+        obj: Object to encode
+        default: Called for objects the encoder cannot serialize natively
+    
+    Returns:
+        str: JSON text
+    
+    Raises:
+        TypeError: If obj contains a value that cannot be serialized
+    """
+    if HAS_ORJSON:
+        return dumps_bytes(obj, default).decode("utf-8")
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False)
+
+
+def iterencode(obj: Any, default: Callable[[Any], Any] | None = None) -> Iterator[str]:
+    """
+    Encode an object as compact JSON text, yielded in chunks.
+    
+    Always uses the standard library encoder (orjson cannot stream), so
+    prefer dumps_bytes() unless the caller may stop before the end.
+    
+    Args:
+        obj: Object to encode
+        default: Called for objects the encoder cannot serialize natively
+    
+    Returns:
+        Iterator[str]: Successive pieces of the JSON text
+    """
+    encoder = json.JSONEncoder(default=default, separators=(",", ":"), ensure_ascii=False)
+    return encoder.iterencode(obj)
@@ -1,28 +1,99 @@
 """
 Middleware for request ID tracking and 5xx error capture.
 """
-import json
+import functools
+import logging
 import random
-import sys
 import time
-from typing import Any
+import traceback
+import uuid
+from typing import Any, Callable
 
-from django.contrib.contenttypes.models import ContentType
+from django.core.signals import setting_changed
+from django.http import QueryDict
 from django.http.request import RawPostDataException
+from django.utils.datastructures import MultiValueDict
 from django.utils.deprecation import MiddlewareMixin
 
-from django_blackbox.conf import get_conf
+from django_blackbox import jsonutils
+from django_blackbox.activity.utils import compute_diff
+from django_blackbox.conf import get_conf, reset_config
 from django_blackbox.models import Incident, RequestActivity
-from django_blackbox.request_id import get_request_id, new_request_id, set_request_id
+from django_blackbox.request_id import _set as _set_request_id
+from django_blackbox.request_id import get_request_id, new_request_uuid
 from django_blackbox.services import log_5xx_response_and_decorate, log_exception_and_build_response
 from django_blackbox.utils import (
+    body_too_large,
+    collect_request_headers,
     extract_ip_address,
     extract_user_agent,
     redact_body,
     redact_headers,
+    request_state,
     safe_log_to_file,
     sanitize_for_json,
+    should_capture_status_code,
 )
+from django_blackbox.writer import get_activity_writer
+
+try:
+    from rest_framework.response import Response as _DRFResponse
+except ImportError:
+    _DRFResponse = None
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_request_id(request: Any) -> str:
+    """
+    Assign the request its ID if it does not have one yet.
+    
+    Uses the incoming X-Request-ID header when present, otherwise generates
+    a new ID, and stores it on the request and in the request-ID context
+    variable. Safe to call more than once per request.
+    
+    Args:
+        request: The Django request object.
+        
+    Returns:
+        str: The request ID.
+    """
+    request_id = request.__dict__.get("django_blackbox_request_id")
+    if request_id:
+        return request_id
+    
+    # Use incoming X-Request-ID if present, otherwise generate a new one
+    request_id = request.META.get("HTTP_X_REQUEST_ID")
+    if not request_id:
+        # Generated from a UUID so incident linking can reuse the parsed form
+        request_id_uuid = new_request_uuid()
+        request_state(request)["rid_uuid"] = request_id_uuid
+        request_id = request_id_uuid.hex
+    
+    _set_request_id(request_id)
+    
+    # Also attach to request for easy access
+    request.django_blackbox_request_id = request_id
+    return request_id
+
+
+def _multivalue_to_dict(data: MultiValueDict) -> dict:
+    """
+    Flatten a QueryDict/MultiValueDict: a list for repeated keys, else the value.
+    
+    orjson would encode the internal lists for every key and the stdlib only
+    the last values, so bodies are flattened before encoding to keep the
+    stored shape independent of the JSON backend.
+    """
+    result = {}
+    for key, values in data.lists():
+        result[key] = values if len(values) > 1 else (values[0] if values else None)
+    return result
+
+
+def _sanitized_diff(instance_before: dict, instance_after: dict) -> dict:
+    """Diff two unsanitized instance states and make the result JSON-safe."""
+    return sanitize_for_json(compute_diff(instance_before, instance_after))
 
 
 class BodyCaptureMiddleware(MiddlewareMixin):
@@ -57,14 +128,18 @@ class BodyCaptureMiddleware(MiddlewareMixin):
         This reads request.body once at the very beginning, which:
         - Populates Django's internal _body cache
         - Allows DRF/CSRF to read it later without issues
-        - Stores a copy in request._django_blackbox_raw_body for our logging
+        - Stores a copy in request_state(request)["raw_body"] for our logging
         """
         # Only cache for mutating methods; safe no-op for others
         raw_body = None
         try:
-            if request.method.upper() in ("POST", "PUT", "PATCH", "DELETE"):
+            if (
+                request.method.upper() in ("POST", "PUT", "PATCH", "DELETE")
+                and body_too_large(request) is None
+            ):
                 # Accessing request.body here populates request._body and caches the stream.
                 # Django will then reuse this cached body for request.POST / DRF parsing.
+                # Large uploads are left to Django so they can stream to disk.
                 raw_body = request.body
         except RawPostDataException:
             # Body was already read by an even earlier middleware; cannot recover
@@ -74,13 +149,38 @@ class BodyCaptureMiddleware(MiddlewareMixin):
             raw_body = None
         
         # Store cached raw body for downstream use
-        request._django_blackbox_raw_body = raw_body
+        request_state(request)["raw_body"] = raw_body
         
         response = self.get_response(request)
         return response
 
 
-class RequestIDMiddleware(MiddlewareMixin):
+class _ConfBoundMiddleware(MiddlewareMixin):
+    """
+    Base for middlewares that read the configuration on every request.
+    
+    The Config is bound once at construction instead of calling get_conf()
+    per request, and re-bound when DJANGO_BLACKBOX is overridden.
+    """
+
+    def __init__(self, get_response):
+        """Initialize middleware and bind the current configuration."""
+        super().__init__(get_response)
+        self._bind_conf()
+        setting_changed.connect(self._on_setting_changed)
+
+    def _bind_conf(self) -> None:
+        """Bind the current configuration (and derived flags) to the instance."""
+        self._conf = get_conf()
+
+    def _on_setting_changed(self, setting: str, **kwargs: Any) -> None:
+        """Refresh the bound configuration after a settings override."""
+        if setting == "DJANGO_BLACKBOX":
+            reset_config()
+            self._bind_conf()
+
+
+class RequestIDMiddleware(_ConfBoundMiddleware):
     """
     Middleware to track request IDs and add X-Request-ID header to responses.
     
@@ -88,6 +188,11 @@ class RequestIDMiddleware(MiddlewareMixin):
     adds it to the response headers.
     """
 
+    def _bind_conf(self) -> None:
+        """Bind the configuration and the response-header flag."""
+        super()._bind_conf()
+        self._add_request_id_header = self._conf.ADD_REQUEST_ID_HEADER
+
     def process_request(self, request):
         """
         Set request ID from incoming header or generate new one.
@@ -95,20 +200,7 @@ class RequestIDMiddleware(MiddlewareMixin):
         Args:
             request: The Django request object.
         """
-        # Try to get X-Request-ID from incoming request
-        incoming_rid = request.META.get("HTTP_X_REQUEST_ID")
-        
-        # Use incoming ID if present, otherwise generate new one
-        if incoming_rid:
-            request_id = incoming_rid
-        else:
-            request_id = new_request_id()
-        
-        # Set in context
-        set_request_id(request_id)
-        
-        # Also attach to request for easy access
-        request.django_blackbox_request_id = request_id
+        ensure_request_id(request)
 
     def process_response(self, request, response):
         """
@@ -121,9 +213,7 @@ class RequestIDMiddleware(MiddlewareMixin):
         Returns:
             The response with X-Request-ID header added.
         """
-        config = get_conf()
-        
-        if config.ADD_REQUEST_ID_HEADER:
+        if self._add_request_id_header:
             rid = get_request_id()
             if rid:
                 response["X-Request-ID"] = rid
@@ -131,13 +221,18 @@ class RequestIDMiddleware(MiddlewareMixin):
         return response
 
 
-class Capture5xxMiddleware(MiddlewareMixin):
+class Capture5xxMiddleware(_ConfBoundMiddleware):
     """
     Middleware to capture 5xx errors and return traceable error responses.
     
     Only captures server-side failures (5xx), never 4xx errors.
     """
 
+    def _bind_conf(self) -> None:
+        """Bind the configuration and the exception-capture flag."""
+        super()._bind_conf()
+        self._capture_exceptions = self._conf.ENABLED and self._conf.CAPTURE_EXCEPTIONS
+
     def process_exception(self, request, exception):
         """
         Process exceptions and create incidents.
@@ -147,18 +242,24 @@ class Capture5xxMiddleware(MiddlewareMixin):
             exception: The exception that occurred.
             
         Returns:
-            JsonResponse | None: A JSON response if configured, None to use default handler.
+            HttpResponse | None: A JSON response if configured, None to use default handler.
         """
-        config = get_conf()
-        
-        if not config.ENABLED or not config.CAPTURE_EXCEPTIONS:
+        if not self._capture_exceptions:
             return None
         
-        # Store exception info in request for later retrieval
-        request._django_blackbox_exception_info = sys.exc_info()
+        # Store exception info in request for later retrieval. Keep a frame-free
+        # snapshot: the raw traceback would pin every frame's locals until the
+        # response is sent.
+        request_state(request)["exc_info"] = (
+            type(exception),
+            str(exception),
+            traceback.TracebackException.from_exception(
+                exception, limit=self._conf.MAX_STACK_FRAMES, lookup_lines=False
+            ),
+        )
         
         # Try to log and build response
-        response = log_exception_and_build_response(request, exception)
+        response = log_exception_and_build_response(request, exception, config=self._conf)
         
         # If we got a JSON response, return it
         # Otherwise, let Django's default 500 handler deal with it
@@ -176,34 +277,31 @@ class Capture5xxMiddleware(MiddlewareMixin):
         Returns:
             The response with added headers.
         """
+        # Most responses are never captured: skip every other probe for them
+        if not should_capture_status_code(getattr(response, "status_code", 200), config=self._conf):
+            return response
+        
         # Skip if we already handled this in process_exception or DRF handler
-        # Check if incident was already created (either via flag or X-Incident-ID header)
         if hasattr(response, '_django_blackbox_incident_created'):
             return response
             
-        if hasattr(request, '_django_blackbox_incident_created') and request._django_blackbox_incident_created:
+        state = request_state(request)
+        if state["incident_created"]:
             return response
         
-        # Check if X-Incident-ID header is already set (indicating DRF handler created it)
-        # This is more reliable than checking the request flag
-        try:
-            # Works for both Django HttpResponse and DRF Response
-            incident_id_header = response.get('X-Incident-ID') if hasattr(response, 'get') else None
-            if not incident_id_header and hasattr(response, 'headers'):
-                incident_id_header = response.headers.get('X-Incident-ID', '')
-        except (AttributeError, TypeError, KeyError):
-            incident_id_header = None
-            
-        if incident_id_header:
+        # Check if X-Incident-ID header is already set (indicating DRF handler created it).
+        # Django HttpResponse and DRF Response both expose a case-insensitive get().
+        getter = getattr(response, "get", None)
+        if getter is not None and getter("X-Incident-ID"):
             # Mark request so subsequent checks also skip
-            request._django_blackbox_incident_created = True
+            state["incident_created"] = True
             return response
         
-        response = log_5xx_response_and_decorate(request, response)
+        response = log_5xx_response_and_decorate(request, response, config=self._conf)
         return response
 
 
-class ActivityLoggingMiddleware(MiddlewareMixin):
+class ActivityLoggingMiddleware(_ConfBoundMiddleware):
     """
     Middleware to log all HTTP request/response activity.
     
@@ -211,28 +309,33 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
     Should be placed after RequestIDMiddleware but before Capture5xxMiddleware.
     """
 
-    def __init__(self, get_response):
-        """Initialize middleware."""
-        self.get_response = get_response
-        super().__init__(get_response)
+    def _bind_conf(self) -> None:
+        """Bind the configuration and the per-request gating settings."""
+        super()._bind_conf()
+        self._enabled = self._conf.ACTIVITY_LOG_ENABLED
+        self._ignore_re = self._conf.activity_ignore_paths_re
+        self._sample_rate = self._conf.ACTIVITY_LOG_SAMPLE_RATE
 
     def __call__(self, request):
         """Process request and log activity."""
+        # Disabled: pass straight through
+        if not self._enabled:
+            return self.get_response(request)
+        
         from django_blackbox.activity_tracking import start_activity_context
         
-        config = get_conf()
+        config = self._conf
         
-        # Check if activity logging is enabled
-        if not config.ACTIVITY_LOG_ENABLED:
-            return self.get_response(request)
+        # A no-op when RequestIDMiddleware already ran; otherwise this
+        # middleware works on its own
+        ensure_request_id(request)
         
         # Check if path should be ignored
-        for pattern in config._compiled_activity_ignore_paths:
-            if pattern.search(request.path):
-                return self.get_response(request)
+        if self._ignore_re is not None and self._ignore_re.search(request.path):
+            return self.get_response(request)
         
         # Check sample rate
-        if random.random() >= config.ACTIVITY_LOG_SAMPLE_RATE:
+        if self._sample_rate < 1.0 and random.random() >= self._sample_rate:
             return self.get_response(request)
         
         # NEW: start per-request activity tracking context
@@ -240,8 +343,8 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         start_activity_context()
         
         # Record start time
-        start_time = time.monotonic()
-        request._activity_start_time = start_time
+        start_time = time.perf_counter_ns()
+        request_state(request)["start_time"] = start_time
         
         # Process request
         try:
@@ -253,25 +356,21 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         finally:
             # Always log activity, even if exception occurred
             try:
-                self._log_activity(request, response, start_time)
+                self._log_activity(request, response, start_time, config)
             except Exception:
                 # Never break the response due to logging errors
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.exception("Failed to log request activity")
         
         return response
 
-    def _log_activity(self, request: Any, response: Any, start_time: float) -> None:
+    def _log_activity(self, request: Any, response: Any, start_time: int, config: Any) -> None:
         """Log request activity to database."""
-        config = get_conf()
-        
         response_time_ms = self._get_response_time_ms(start_time)
         request_id = self._get_request_id(request)
         method, path, full_path, http_status = self._collect_basic_request_info(request, response)
         view_name, route_name = self._resolve_view_info(request)
         request_headers = self._collect_request_headers(request, config)
-        request_body = self._build_request_body(request, method, config)
+        request_body = self._build_request_body(request, method, config, defer=config.ACTIVITY_LOG_ASYNC)
         response_headers = self._collect_response_headers(response, config)
         response_body = self._build_response_body(response, config)
         user, is_authenticated = self._resolve_user(request)
@@ -294,6 +393,17 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         from django_blackbox.activity_tracking import get_tracked_change_for
         tracked_before, tracked_after, tracked_diff = get_tracked_change_for(content_type, object_id)
         
+        if instance_diff is None:
+            # Deferred by set_request_activity_change(): diff the states it was
+            # given (unsanitized, so equal Decimals/datetimes stay unchanged)
+            if not (instance_before or instance_after):
+                instance_diff = {}
+            elif config.ACTIVITY_LOG_ASYNC and not tracked_diff:
+                # Nothing to fall back to, so the writer thread can compute it
+                instance_diff = functools.partial(_sanitized_diff, instance_before, instance_after)
+            else:
+                instance_diff = compute_diff(instance_before, instance_after)
+        
         # If manual context didn't set them, use tracked values from signals
         if not instance_before and tracked_before:
             instance_before = tracked_before
@@ -302,20 +412,7 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         if not instance_diff and tracked_diff:
             instance_diff = tracked_diff
         
-        # Resolve action and finalize change context
-        action, instance_before, instance_after, instance_diff, custom_action, custom_payload = \
-            self._resolve_action_and_change_context(
-                method,
-                object_id,
-                {
-                    "action": explicit_action,
-                    "custom_action": custom_action,
-                    "custom_payload": custom_payload,
-                    "instance_before": instance_before,
-                    "instance_after": instance_after,
-                    "instance_diff": instance_diff,
-                },
-            )
+        action = self._resolve_action(method, object_id, explicit_action, custom_action, instance_before)
         
         self._create_request_activity(
             method, path, full_path,
@@ -330,9 +427,9 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             config,
         )
     
-    def _get_response_time_ms(self, start_time: float) -> float:
-        """Calculate response time in milliseconds."""
-        return (time.monotonic() - start_time) * 1000
+    def _get_response_time_ms(self, start_time: int) -> float:
+        """Calculate response time in milliseconds from a perf_counter_ns() start."""
+        return (time.perf_counter_ns() - start_time) / 1_000_000
     
     def _get_request_id(self, request: Any) -> str:
         """Get request ID from request object or context."""
@@ -360,24 +457,18 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
     
     def _collect_request_headers(self, request: Any, config: Any) -> dict:
         """Collect and redact request headers."""
-        request_headers = {}
-        for key, value in request.META.items():
-            if key.startswith("HTTP_"):
-                header_name = key[5:].replace("_", "-").title()
-                request_headers[header_name] = value
-        
-        if config.REDACT_SENSITIVE_DATA:
-            request_headers = redact_headers(request_headers, config.REDACT_HEADERS, config.REDACT_MASK)
-        
-        return request_headers
+        return collect_request_headers(request, config=config)
     
-    def _build_request_body(self, request: Any, method: str, config: Any) -> str:
-        """Build unified request body payload including query params and body data."""
-        import logging
-        from django.http import QueryDict
-        
-        logger = logging.getLogger(__name__)
+    def _build_request_body(
+        self, request: Any, method: str, config: Any, defer: bool = False
+    ) -> str | Callable[[], str]:
+        """
+        Build unified request body payload including query params and body data.
         
+        With ``defer``, only the inputs are collected here; a zero-argument
+        callable is returned that parses, redacts and serializes them later
+        (in the background writer).
+        """
         request_payload = {}
         
         # 1. Collect query parameters
@@ -385,10 +476,7 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         try:
             qd = request.GET
             if isinstance(qd, QueryDict) and qd:
-                query_params = {
-                    k: qd.getlist(k) if len(qd.getlist(k)) > 1 else qd.get(k)
-                    for k in qd.keys()
-                }
+                query_params = _multivalue_to_dict(qd)
         except Exception:
             query_params = {}
         
@@ -412,10 +500,7 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             try:
                 post_qd = request.POST
                 if isinstance(post_qd, QueryDict) and post_qd:
-                    body_data = {
-                        k: post_qd.getlist(k) if len(post_qd.getlist(k)) > 1 else post_qd.get(k)
-                        for k in post_qd.keys()
-                    }
+                    body_data = _multivalue_to_dict(post_qd)
             except Exception:
                 pass
         
@@ -438,8 +523,7 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             "Blackbox body debug: GET=%s POST=%s body_data=%s",
             dict(request.GET), dict(request.POST), body_data is not None,
         )
-        raw_body_text = ""
-        raw_body_cached = getattr(request, "_django_blackbox_raw_body", None)
+        raw_body_cached = request_state(request)["raw_body"]
         
         logger.debug(
             "Blackbox body debug: method=%s content_type=%s has_data_attr=%s raw_body_cached=%s",
@@ -458,29 +542,45 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             (content_type in store_body_types or "application/json" in content_type)
         )
         
-        if should_use_raw and isinstance(raw_body_cached, bytes) and raw_body_cached:
+        raw_body = raw_body_cached if should_use_raw and isinstance(raw_body_cached, bytes) else b""
+        render = functools.partial(
+            self._render_request_body, request_payload, body_data, raw_body, content_type, config
+        )
+        return render if defer else render()
+    
+    def _render_request_body(
+        self, request_payload: dict, body_data: Any, raw_body: bytes, content_type: str, config: Any
+    ) -> str:
+        """Parse, redact and serialize the request payload collected by _build_request_body."""
+        max_body_bytes = config.MAX_BODY_BYTES
+        raw_body_text = ""
+        
+        if raw_body:
             try:
                 # Debug: log raw body preview
-                logger.debug("Blackbox body raw cached preview: %r", raw_body_cached[:256])
+                logger.debug("Blackbox body raw cached preview: %r", raw_body[:256])
             except Exception:
                 pass
             
             # Try JSON first if content-type suggests it
             if "application/json" in content_type:
                 try:
-                    body_data = json.loads(raw_body_cached.decode("utf-8"))
+                    body_data = jsonutils.loads(raw_body)
                     logger.debug("Blackbox body: Successfully parsed cached raw body as JSON")
-                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                except ValueError as e:
                     # Not valid JSON; fall back to raw text
                     logger.debug("Blackbox body: JSON parse failed on cached body: %s", e)
-                    truncated = raw_body_cached[:config.MAX_BODY_BYTES]
+                    truncated = raw_body[:max_body_bytes]
                     raw_body_text = truncated.decode("utf-8", errors="replace")
             else:
                 # Not JSON content-type, store as raw text
-                truncated = raw_body_cached[:config.MAX_BODY_BYTES]
+                truncated = raw_body[:max_body_bytes]
                 raw_body_text = truncated.decode("utf-8", errors="replace")
         
         # 4. Add body data or raw body to payload
+        if isinstance(body_data, MultiValueDict):
+            # e.g. DRF request.data on form posts
+            body_data = _multivalue_to_dict(body_data)
         if body_data is not None:
             request_payload["body"] = body_data
         elif raw_body_text:
@@ -490,9 +590,10 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         if config.REDACT_SENSITIVE_DATA and request_payload:
             if "body" in request_payload and isinstance(request_payload["body"], dict):
                 redacted_body = request_payload["body"].copy()
+                mask = config.REDACT_MASK
                 for field in config.REDACT_FIELDS:
                     if field in redacted_body:
-                        redacted_body[field] = config.REDACT_MASK
+                        redacted_body[field] = mask
                 request_payload["body"] = redacted_body
         
         # 6. Convert to JSON string
@@ -500,84 +601,90 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             return ""
         
         try:
-            text = json.dumps(request_payload, default=str, separators=(",", ":"), ensure_ascii=False)
-            data_bytes = text.encode("utf-8")
-            if len(data_bytes) > config.MAX_BODY_BYTES:
-                return data_bytes[:config.MAX_BODY_BYTES].decode("utf-8", errors="replace") + "..."
-            return text
+            data_bytes = jsonutils.dumps_bytes(request_payload, default=str)
+            if len(data_bytes) > max_body_bytes:
+                return data_bytes[:max_body_bytes].decode("utf-8", errors="replace") + "..."
+            return data_bytes.decode("utf-8")
         except Exception as e:
             logger.debug("Blackbox body: Exception serializing payload: %s", e)
             return ""
     
     def _collect_response_headers(self, response: Any, config: Any) -> dict:
         """Collect and redact response headers."""
-        response_headers = {}
-        if response:
-            try:
-                if hasattr(response, "headers"):
-                    # DRF Response (headers is a dict-like object)
-                    response_headers = dict(response.headers)
-                elif hasattr(response, "_headers"):
-                    # Django HttpResponse (older style)
-                    response_headers = {k: v for k, v in response._headers.values()}
-                else:
-                    # Try get method for standard HttpResponse
-                    if hasattr(response, "keys"):
-                        for key in response.keys():
-                            response_headers[key] = response.get(key, "")
-            except Exception:
-                response_headers = {}
+        if not response:
+            return {}
         
-        if config.REDACT_SENSITIVE_DATA:
-            response_headers = redact_headers(response_headers, config.REDACT_HEADERS, config.REDACT_MASK)
-        
-        return response_headers
+        try:
+            if hasattr(response, "headers"):
+                # Django >= 3.2 HttpResponse / DRF Response (dict-like object)
+                pairs = response.headers.items()
+            elif hasattr(response, "_headers"):
+                # Django HttpResponse (older style)
+                pairs = response._headers.values()
+            elif hasattr(response, "keys"):
+                # Try get method for standard HttpResponse
+                pairs = ((key, response.get(key, "")) for key in response.keys())
+            else:
+                return {}
+            
+            if config.REDACT_SENSITIVE_DATA:
+                return redact_headers(pairs, config.redact_headers_set, config.REDACT_MASK)
+            return dict(pairs)
+        except Exception:
+            return {}
     
     def _build_response_body(self, response: Any, config: Any) -> str:
         """Build response body string."""
-        store_response_body = getattr(config, "STORE_RESPONSE_BODY", True)
         response_body = ""
         
-        if store_response_body and response:
+        if config.STORE_RESPONSE_BODY and response:
+            max_bytes = config.MAX_RESPONSE_BODY_BYTES
+            if getattr(response, "streaming", False):
+                # Streaming/file responses: never drain the iterator just to log it
+                return "<streaming response omitted>"
             try:
-                # Try DRF Response first
-                try:
-                    from rest_framework.response import Response as DRFResponse
-                except ImportError:
-                    DRFResponse = None
+                # Rendered responses (e.g. DRF after finalize_response) already hold
+                # the serialized bytes: slice them instead of re-encoding response.data.
+                if getattr(response, "is_rendered", False):
+                    raw_content = self._peek_response_content(response, max_bytes + 1)
+                    response_body = raw_content[:max_bytes].decode("utf-8", errors="replace")
+                    if len(raw_content) > max_bytes:
+                        response_body += "..."
+                    return response_body
                 
-                is_drf_response = DRFResponse is not None and isinstance(response, DRFResponse)
+                # Try DRF Response first
+                is_drf_response = _DRFResponse is not None and isinstance(response, _DRFResponse)
                 has_data_attr = hasattr(response, "data")
                 
                 if is_drf_response or has_data_attr:
                     try:
                         data = response.data
                         if data is not None:
+                            if isinstance(data, MultiValueDict):
+                                data = _multivalue_to_dict(data)
                             if isinstance(data, (dict, list)):
-                                response_body_text = json.dumps(data, default=str, separators=(",", ":"), ensure_ascii=False)
+                                response_body_bytes = jsonutils.dumps_bytes(data, default=str)
                             else:
-                                response_body_text = str(data)
+                                response_body_bytes = str(data).encode("utf-8")
                             
                             # Truncate if needed
-                            response_body_bytes = response_body_text.encode("utf-8")
-                            if len(response_body_bytes) > config.MAX_RESPONSE_BODY_BYTES:
-                                response_body = response_body_bytes[:config.MAX_RESPONSE_BODY_BYTES].decode("utf-8", errors="replace") + "..."
+                            if len(response_body_bytes) > max_bytes:
+                                response_body = response_body_bytes[:max_bytes].decode("utf-8", errors="replace") + "..."
                             else:
-                                response_body = response_body_text
+                                response_body = response_body_bytes.decode("utf-8")
                     except (TypeError, ValueError, AttributeError):
                         # Fallback: try to stringify
                         try:
-                            response_body = str(response.data)[:config.MAX_RESPONSE_BODY_BYTES]
+                            response_body = str(response.data)[:max_bytes]
                         except Exception:
                             response_body = ""
                 
                 # Fallback: use response.content if DRF data didn't work
                 if not response_body and hasattr(response, "content"):
                     try:
-                        raw_content = response.content
-                        if isinstance(raw_content, bytes) and raw_content:
-                            truncated = raw_content[:config.MAX_RESPONSE_BODY_BYTES]
-                            response_body = truncated.decode("utf-8", errors="replace")
+                        raw_content = self._peek_response_content(response, max_bytes)
+                        if raw_content:
+                            response_body = raw_content.decode("utf-8", errors="replace")
                     except Exception:
                         response_body = ""
             except Exception:
@@ -585,6 +692,29 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         
         return response_body
     
+    def _peek_response_content(self, response: Any, max_bytes: int) -> bytes:
+        """
+        Return at most ``max_bytes`` of the response body.
+        
+        Joins only as many chunks of HttpResponse's internal container as are
+        needed, instead of materializing the full ``response.content``.
+        """
+        container = getattr(response, "_container", None)
+        if isinstance(container, list) and all(isinstance(chunk, bytes) for chunk in container):
+            chunks = []
+            size = 0
+            for chunk in container:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    break
+            return b"".join(chunks)[:max_bytes]
+        
+        raw_content = response.content
+        if isinstance(raw_content, bytes):
+            return raw_content[:max_bytes]
+        return b""
+    
     def _resolve_user(self, request: Any) -> tuple[Any, bool]:
         """Resolve user from request."""
         user = None
@@ -597,10 +727,19 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
     def _resolve_incident(self, request: Any, request_id: str) -> Any:
         """Resolve linked incident if one was created."""
         incident = None
-        if hasattr(request, "_django_blackbox_incident_created") and request._django_blackbox_incident_created:
+        state = request_state(request)
+        if state["incident_created"]:
+            # Reuse the incident handed over by the services layer (no extra query).
+            # Fallback namespaces from a failed persist have no row to link to.
+            incident = state["incident"]
+            if incident is not None:
+                return incident if isinstance(incident, Incident) else None
+
+            # Flag set without an incident (e.g. by third-party code): look it up
             try:
-                import uuid
-                request_id_uuid = uuid.UUID(request_id) if request_id else None
+                request_id_uuid = state["rid_uuid"]
+                if request_id_uuid is None and request_id:
+                    request_id_uuid = uuid.UUID(request_id)
                 if request_id_uuid:
                     incident = Incident.objects.filter(request_id=request_id_uuid).order_by("-occurred_at").first()
             except (ValueError, TypeError, AttributeError):
@@ -617,10 +756,6 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         Returns:
             (content_type, object_id)
         """
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        
         content_type = None
         object_id = ""
         
@@ -709,8 +844,10 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             
             # 5. Build content_type if model is found
             if model is not None:
+                from django_blackbox.activity_tracking import content_type_for
+                
                 try:
-                    content_type = ContentType.objects.get_for_model(model)
+                    content_type = content_type_for(model)
                 except Exception:
                     content_type = None
         except Exception:
@@ -719,31 +856,22 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         
         return content_type, object_id
     
-    def _resolve_action_and_change_context(
-        self, method: str, object_id: str, activity_ctx: dict
-    ) -> tuple[str, dict, dict, dict, str, dict]:
-        """Resolve action and instance change context."""
-        explicit_action = activity_ctx.get("action")
-        custom_action = activity_ctx.get("custom_action", "")
-        custom_payload = activity_ctx.get("custom_payload", {})
-        instance_before = activity_ctx.get("instance_before", {})
-        instance_after = activity_ctx.get("instance_after", {})
-        instance_diff = activity_ctx.get("instance_diff", {})
-        
+    def _resolve_action(
+        self, method: str, object_id: str, explicit_action: str | None, custom_action: str, instance_before: dict
+    ) -> str:
+        """Resolve the action label from the explicit action, custom action or HTTP method."""
         method_upper = method.upper() if method else ""
         
         if explicit_action is not None and explicit_action != "":
             action = explicit_action
-        elif custom_action and (explicit_action is None or explicit_action == ""):
+        elif custom_action:
             action = "CUSTOM"
         else:
             # Default action mapping based on HTTP method
             if method_upper == "GET":
                 action = "VIEW"
             elif method_upper == "POST":
-                has_object_context = bool(object_id)
-                has_instance_before = bool(instance_before)
-                if has_object_context or has_instance_before:
+                if object_id or instance_before:
                     action = "UPDATE"
                 else:
                     action = "CREATE"
@@ -754,7 +882,7 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
             else:
                 action = method_upper or ""
         
-        return action, instance_before, instance_after, instance_diff, custom_action, custom_payload
+        return action
     
     def _create_request_activity(
         self,
@@ -765,20 +893,25 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
         content_type: Any, object_id: str,
         request_headers: dict, request_body: str,
         response_headers: dict, response_body: str,
-        action: str, instance_before: dict, instance_after: dict, instance_diff: dict,
+        action: str, instance_before: dict, instance_after: dict, instance_diff: dict | Callable[[], dict],
         custom_action: str, custom_payload: dict,
         config: Any,
     ) -> None:
         """Create RequestActivity record in database."""
         try:
             # Sanitize JSON fields to ensure all values are JSON-serializable
-            # This converts UUID, datetime, Decimal, etc. to strings
-            instance_before = sanitize_for_json(instance_before)
-            instance_after = sanitize_for_json(instance_after)
-            instance_diff = sanitize_for_json(instance_diff)
-            custom_payload = sanitize_for_json(custom_payload)
+            # This converts UUID, datetime, Decimal, etc. to strings.
+            # Share one memo so sub-trees common to several payloads are walked once.
+            cache = {}
+            instance_before = sanitize_for_json(instance_before, cache)
+            instance_after = sanitize_for_json(instance_after, cache)
+            custom_payload = sanitize_for_json(custom_payload, cache)
+            if not callable(instance_diff):
+                # A callable is a deferred diff, resolved by the background writer
+                instance_diff = sanitize_for_json(instance_diff, cache)
             
-            RequestActivity.objects.create(
+            # Foreign keys are passed as raw ids so queued rows hold no model instances
+            fields = dict(
                 method=method,
                 path=path,
                 full_path=full_path,
@@ -787,12 +920,12 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
                 view_name=view_name,
                 route_name=route_name,
                 request_id=request_id,
-                incident=incident,
-                user=user,
+                incident_id=incident.pk if incident is not None else None,
+                user_id=user.pk if user is not None else None,
                 is_authenticated=is_authenticated,
                 ip_address=ip_address,
                 user_agent=user_agent,
-                content_type=content_type,
+                content_type_id=content_type.pk if content_type is not None else None,
                 object_id=object_id,
                 request_headers=request_headers,
                 request_body=request_body,
@@ -805,10 +938,13 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
                 custom_action=custom_action,
                 custom_payload=custom_payload,
             )
+            if config.ACTIVITY_LOG_ASYNC:
+                # Written in batches by the background writer, off the request path
+                get_activity_writer().enqueue(fields)
+            else:
+                RequestActivity.objects.create(**fields)
         except Exception as e:
             # Fallback logging
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Failed to persist request activity to database: {e}")
             
             # Log to file
@@ -818,5 +954,5 @@ class ActivityLoggingMiddleware(MiddlewareMixin):
                 "path": path,
                 "http_status": http_status,
                 "persist_error": str(e),
-            })
+            }, config=config)
 
@@ -1,7 +1,7 @@
 # Generated by Django 5.2.8 on 2025-12-04 06:25
 
-import django.contrib.postgres.fields
 import django.db.models.deletion
+import django_blackbox.fields
 import uuid
 from django.conf import settings
 from django.db import migrations, models
@@ -41,7 +41,7 @@ class Migration(migrations.Migration):
                 ('occurred_at', models.DateTimeField(auto_now_add=True, db_index=True)),
                 ('resolved_at', models.DateTimeField(blank=True, null=True)),
                 ('notes', models.TextField(blank=True, null=True)),
-                ('tags', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), blank=True, default=list, size=None)),
+                ('tags', django_blackbox.fields.tags_field()),
                 ('dedup_hash', models.CharField(db_index=True, max_length=64)),
                 ('occurrence_count', models.IntegerField(default=1)),
             ],
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def seed_incident_counter(apps, schema_editor):
+    """Seed the counter row from the highest existing INCIDENT-N id."""
+    Incident = apps.get_model("django_blackbox", "Incident")
+    IncidentCounter = apps.get_model("django_blackbox", "IncidentCounter")
+    db_alias = schema_editor.connection.alias
+
+    highest = 0
+    incident_ids = Incident.objects.using(db_alias).filter(
+        incident_id__startswith="INCIDENT-"
+    ).values_list("incident_id", flat=True)
+    for incident_id in incident_ids.iterator():
+        try:
+            highest = max(highest, int(incident_id.split("-", 1)[1]))
+        except (ValueError, IndexError):
+            continue
+
+    IncidentCounter.objects.using(db_alias).update_or_create(
+        pk=1, defaults={"next_num": highest + 1}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0002_incident_valid_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IncidentCounter",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("next_num", models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(seed_incident_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0003_incidentcounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="incident",
+            index=models.Index(
+                condition=models.Q(status="OPEN"),
+                fields=["dedup_hash", "occurred_at"],
+                name="bb_dedup_open_idx",
+            ),
+        ),
+    ]
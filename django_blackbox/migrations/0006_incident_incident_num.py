@@ -0,0 +1,54 @@
+import re
+
+from django.db import migrations, models
+
+INCIDENT_NUM_RE = re.compile(r"^INCIDENT-(\d+)$")
+
+
+def backfill_incident_num(apps, schema_editor):
+    """Fill incident_num from existing INCIDENT-N ids and resync the counter."""
+    Incident = apps.get_model("django_blackbox", "Incident")
+    IncidentCounter = apps.get_model("django_blackbox", "IncidentCounter")
+    db_alias = schema_editor.connection.alias
+
+    pending = []
+    rows = Incident.objects.using(db_alias).filter(
+        incident_num__isnull=True, incident_id__startswith="INCIDENT-"
+    ).only("pk", "incident_id")
+    for incident in rows.iterator():
+        match = INCIDENT_NUM_RE.match(incident.incident_id)
+        if match:
+            incident.incident_num = int(match.group(1))
+            pending.append(incident)
+    Incident.objects.using(db_alias).bulk_update(pending, ["incident_num"], batch_size=1000)
+
+    highest = Incident.objects.using(db_alias).aggregate(
+        highest=models.Max("incident_num")
+    )["highest"] or 0
+    counter = IncidentCounter.objects.using(db_alias).filter(pk=1).first()
+    if counter is None:
+        IncidentCounter.objects.using(db_alias).create(pk=1, next_num=highest + 1)
+    elif counter.next_num <= highest:
+        counter.next_num = highest + 1
+        counter.save(update_fields=["next_num"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0005_postgres_gin_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="incident_num",
+            field=models.PositiveIntegerField(
+                blank=True,
+                db_index=True,
+                help_text="Numeric part of a sequential incident_id (INCIDENT-N)",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(backfill_incident_num, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-16 02:37
+
+import django_blackbox.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_blackbox', '0006_incident_incident_num'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='incident',
+            name='headers',
+            field=django_blackbox.fields.JSONField(default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='custom_payload',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='extra',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='instance_after',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='instance_before',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='instance_diff',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='request_headers',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='requestactivity',
+            name='response_headers',
+            field=django_blackbox.fields.JSONField(blank=True, default=dict),
+        ),
+    ]
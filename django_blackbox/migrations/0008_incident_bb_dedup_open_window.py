@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0007_fast_json_fields"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="incident",
+            name="django_blac_dedup_h_633a2b_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="incident",
+            name="bb_dedup_open_idx",
+        ),
+        migrations.AddIndex(
+            model_name="incident",
+            index=models.Index(
+                condition=models.Q(status="OPEN"),
+                fields=["dedup_hash", "-occurred_at"],
+                name="bb_dedup_open_window",
+            ),
+        ),
+    ]
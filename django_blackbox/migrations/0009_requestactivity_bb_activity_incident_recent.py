@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0008_incident_bb_dedup_open_window"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="requestactivity",
+            index=models.Index(fields=["incident", "-created_at"], name="bb_activity_incident_recent"),
+        ),
+        # The composite index above also serves lookups by incident alone
+        migrations.AlterField(
+            model_name="requestactivity",
+            name="incident",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="activities",
+                to="django_blackbox.incident",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# text_pattern_ops lets path__startswith (LIKE 'prefix%') use the index
+# whatever the database collation; http_status and created_at let prefix
+# dashboards filter by status and sort newest first from the same index.
+INDEX_NAME = "bb_act_path_status_idx"
+TABLE = "django_blackbox_requestactivity"
+
+
+def add_path_index(apps, schema_editor):
+    """Add a prefix-searchable index on RequestActivity.path (Postgres only)."""
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    quote = connection.ops.quote_name
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {quote(INDEX_NAME)} ON {quote(TABLE)} "
+        f"({quote('path')} text_pattern_ops, {quote('http_status')}, {quote('created_at')} DESC)"
+    )
+
+
+def remove_path_index(apps, schema_editor):
+    """Drop the index added above (Postgres only)."""
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(INDEX_NAME)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0009_requestactivity_bb_activity_incident_recent"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_path_index, remove_path_index),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_blackbox", "0010_postgres_path_prefix_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="requestactivity",
+            index=models.Index(fields=["request_id", "-created_at"], name="bb_activity_request_recent"),
+        ),
+        # The composite index above also serves lookups by request_id alone
+        migrations.AlterField(
+            model_name="requestactivity",
+            name="request_id",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
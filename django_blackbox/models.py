@@ -1,22 +1,101 @@
 """
 Data models for server incidents.
 """
+import atexit
+import logging
+import re
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from datetime import timedelta
+from typing import Any, Iterable
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, transaction
+from django.db import IntegrityError, close_old_connections, connections, models, router, transaction
 from django.utils import timezone
 
 from django_blackbox.conf import get_conf
+from django_blackbox.fields import JSONField, tags_field
 
-try:
-    from django.contrib.postgres.fields import ArrayField
-except ImportError:
-    # ArrayField not available (not using Postgres)
-    ArrayField = None
+logger = logging.getLogger(__name__)
+
+_INCIDENT_NUM_RE = re.compile(r"^INCIDENT-(\d+)$")
+
+
+# signature -> [incident, window_start (monotonic), pending_count, last_seen],
+# in window_start order so expired entries are always at the front
+_dedup_cache: "OrderedDict[str, list]" = OrderedDict()
+_dedup_lock = threading.Lock()
+_sweep_timer: threading.Timer | None = None
+
+
+def _flush_coalesced(entries: list[list]) -> None:
+    """Write pending occurrence counts for evicted/expired cache entries."""
+    for incident, _started, pending, last_seen in entries:
+        if not pending:
+            continue
+        try:
+            Incident.objects.filter(pk=incident.pk).update(
+                occurrence_count=models.F("occurrence_count") + pending,
+                occurred_at=last_seen,
+            )
+        except Exception as e:
+            logger.error(f"Failed to flush coalesced incident occurrences: {e}")
+
+
+def _pop_expired(now: float, coalesce_seconds: float) -> list[list]:
+    """Remove and return cache entries whose window has passed (hold _dedup_lock)."""
+    expired = []
+    while _dedup_cache:
+        entry = next(iter(_dedup_cache.values()))
+        if now - entry[1] < coalesce_seconds:
+            break
+        expired.append(_dedup_cache.popitem(last=False)[1])
+    return expired
+
+
+def _schedule_sweep(delay: float) -> None:
+    """Start the background sweep timer unless one is already pending."""
+    global _sweep_timer
+    with _dedup_lock:
+        if _sweep_timer is not None and _sweep_timer.is_alive():
+            return
+        _sweep_timer = threading.Timer(delay, _sweep_expired)
+        _sweep_timer.daemon = True
+        _sweep_timer.start()
+
+
+def _sweep_expired() -> None:
+    """
+    Flush expired entries from a timer thread.
+    
+    Runs every DEDUP_COALESCE_SECONDS while counts are pending, so a
+    signature that stops firing still has its count written promptly.
+    """
+    coalesce_seconds = get_conf().DEDUP_COALESCE_SECONDS
+    with _dedup_lock:
+        expired = _pop_expired(time.monotonic(), coalesce_seconds)
+        pending = any(entry[2] for entry in _dedup_cache.values())
+    if any(entry[2] for entry in expired):
+        _flush_coalesced(expired)
+        # The timer thread has its own connection; do not leave it open
+        close_old_connections()
+    if pending and coalesce_seconds > 0:
+        _schedule_sweep(coalesce_seconds)
+
+
+def flush_dedup_cache() -> None:
+    """Flush and clear all coalesced incident occurrences."""
+    with _dedup_lock:
+        entries = list(_dedup_cache.values())
+        _dedup_cache.clear()
+    _flush_coalesced(entries)
+
+
+atexit.register(flush_dedup_cache)
 
 
 class IncidentManager(models.Manager):
@@ -37,49 +116,243 @@ class IncidentManager(models.Manager):
         Args:
             signature: The deduplication hash signature.
             defaults: Dictionary of default values for creating a new incident.
+                "stacktrace" may be a zero-argument callable; it is only called
+                when a new incident is created.
             window_seconds: Time window in seconds to check for duplicate incidents.
             
         Returns:
             tuple: (Incident instance, created: bool)
         """
+        config = get_conf()
+        coalesce_seconds = config.DEDUP_COALESCE_SECONDS
+        incident = self.increment_coalesced(signature)
+        if incident is not None:
+            return incident, False
+        
+        incident, created = self._create_or_increment(signature, defaults, window_seconds)
+        
+        if coalesce_seconds > 0:
+            evicted = []
+            with _dedup_lock:
+                # Re-insert at the end (a concurrent request may have added it)
+                stale = _dedup_cache.pop(signature, None)
+                if stale is not None:
+                    evicted.append(stale)
+                _dedup_cache[signature] = [incident, time.monotonic(), 0, incident.occurred_at]
+                while len(_dedup_cache) > config.DEDUP_COALESCE_MAX_ENTRIES:
+                    evicted.append(_dedup_cache.popitem(last=False)[1])
+            _flush_coalesced(evicted)
+        
+        return incident, created
+
+    def bulk_resolve(self, ids: Iterable[Any]) -> int:
+        """
+        Resolve many incidents with a single UPDATE.
+        
+        Sets resolved_at the way Incident.save() does, without loading or
+        saving each row. Already-resolved incidents keep their resolved_at.
+        
+        Args:
+            ids: Primary keys of the incidents, or a queryset of them.
+            
+        Returns:
+            int: The number of incidents resolved.
+        """
+        return self.filter(pk__in=ids).exclude(status=self.model.Status.RESOLVED).update(
+            status=self.model.Status.RESOLVED,
+            resolved_at=timezone.now(),
+        )
+
+    def increment_coalesced(self, signature: str) -> "Incident | None":
+        """
+        Count an occurrence in memory if the signature was seen very recently.
+        
+        Only applies when DEDUP_COALESCE_SECONDS is set. Callers can try this
+        before collecting request metadata, which a hit does not need.
+        
+        Args:
+            signature: The deduplication hash signature.
+            
+        Returns:
+            Incident | None: The cached incident on a hit, otherwise None.
+        """
+        coalesce_seconds = get_conf().DEDUP_COALESCE_SECONDS
+        if coalesce_seconds <= 0:
+            return None
+        
+        with _dedup_lock:
+            # Write out any signature whose window has passed, not only this one
+            expired = _pop_expired(time.monotonic(), coalesce_seconds)
+            entry = _dedup_cache.get(signature)
+            if entry is not None:
+                # Burst of the same signature: count it in memory only
+                entry[2] += 1
+                entry[3] = timezone.now()
+        _flush_coalesced(expired)
+        if entry is None:
+            return None
+        _schedule_sweep(coalesce_seconds)
+        return entry[0]
+
+    def _create_or_increment(
+        self,
+        signature: str,
+        defaults: dict,
+        window_seconds: int,
+    ) -> tuple["Incident", bool]:
+        """Database part of create_or_increment (no in-process coalescing)."""
         with transaction.atomic():
             # Look for existing incident within the time window
             since = timezone.now() - timedelta(seconds=window_seconds)
             
+            # Only fetch the columns callers use; skip stacktrace/headers/body.
+            # No row lock: the increment below is atomic in SQL.
             existing = self.filter(
                 dedup_hash=signature,
                 occurred_at__gte=since,
                 status="OPEN",
-            ).select_for_update().first()
+            ).only(
+                "id", "incident_id", "request_id", "status", "occurrence_count",
+                "occurred_at", "exception_message", "path", "ip_address",
+            ).first()
             
             if existing:
-                # Increment occurrence count and update timestamp
-                existing.occurrence_count += 1
-                existing.occurred_at = timezone.now()
-                # Update some fields if provided in defaults
-                for key in ["exception_message", "path", "ip_address"]:
-                    if key in defaults and getattr(existing, key, None) != defaults[key]:
-                        setattr(existing, key, defaults[key])
-                existing.save(update_fields=["occurrence_count", "occurred_at", "exception_message", "path", "ip_address"])
+                # Increment occurrence count, bump the timestamp and write only
+                # the fields that actually changed, in one UPDATE
+                changed = {
+                    key: defaults[key]
+                    for key in ("exception_message", "path", "ip_address")
+                    if key in defaults and getattr(existing, key) != defaults[key]
+                }
+                changed["occurred_at"] = timezone.now()
+                existing.occurrence_count = self._increment(existing.pk, changed)
+                for key, value in changed.items():
+                    setattr(existing, key, value)
                 return existing, False
             else:
-                # Create new incident: generate incident_id inside transaction with lock
-                # to avoid race where two workers both get the same "next" id.
+                # Create new incident: the counter row hands out unique numbers,
+                # so concurrent workers never race on the same "next" id.
                 defaults = dict(defaults)
-                last = self.filter(
-                    incident_id__startswith="INCIDENT-"
-                ).order_by("-incident_id").select_for_update().first()
-                if last:
-                    try:
-                        next_num = int(last.incident_id.split("-")[1]) + 1
-                    except (ValueError, IndexError):
-                        next_num = 1
-                else:
-                    next_num = 1
-                defaults["incident_id"] = f"INCIDENT-{next_num:04d}"
+                if callable(defaults.get("stacktrace")):
+                    defaults["stacktrace"] = defaults["stacktrace"]()
+                defaults["incident_id"] = self.model.generate_incident_id()
+                defaults["incident_num"] = self.model.parse_incident_num(defaults["incident_id"])
                 incident = self.create(**defaults)
                 return incident, True
 
+    def _increment(self, pk: int, changed: dict) -> int:
+        """
+        Add one to an incident's occurrence count and write changed fields.
+        
+        On Postgres this is a single ``UPDATE ... RETURNING`` round trip.
+        Other backends run the UPDATE and then read the new count back.
+        
+        Args:
+            pk: Primary key of the incident.
+            changed: Field values to write alongside the increment.
+        
+        Returns:
+            int: The new occurrence count.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        
+        if connection.vendor == "postgresql":
+            opts = self.model._meta
+            quote = connection.ops.quote_name
+            count_column = quote(opts.get_field("occurrence_count").column)
+            assignments = [f"{count_column} = {count_column} + 1"]
+            params = []
+            for name, value in changed.items():
+                field = opts.get_field(name)
+                assignments.append(f"{quote(field.column)} = %s")
+                params.append(field.get_db_prep_save(value, connection))
+            params.append(pk)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {quote(opts.db_table)} SET {', '.join(assignments)} "
+                    f"WHERE {quote(opts.pk.column)} = %s RETURNING {count_column}",
+                    params,
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+        
+        queryset = self.using(using).filter(pk=pk)
+        queryset.update(occurrence_count=models.F("occurrence_count") + 1, **changed)
+        return queryset.values_list("occurrence_count", flat=True).get()
+
+
+class IncidentCounter(models.Model):
+    """
+    Single-row counter backing the sequential INCIDENT-XXXX public IDs.
+    
+    Allocating a number is one row update instead of scanning the incidents
+    table for the current maximum.
+    """
+
+    next_num = models.BigIntegerField(default=1)
+
+    def __str__(self) -> str:
+        """String representation."""
+        return f"IncidentCounter(next_num={self.next_num})"
+
+    @classmethod
+    def initial_value(cls) -> int:
+        """
+        Compute the first free number from existing incidents.
+        
+        Only used to seed the counter row when it does not exist yet; reads
+        the indexed incident_num column instead of parsing every incident_id.
+        
+        Returns:
+            int: The next unused incident number.
+        """
+        highest = Incident.objects.aggregate(highest=models.Max("incident_num"))["highest"]
+        return (highest or 0) + 1
+
+    @classmethod
+    def allocate(cls) -> int:
+        """
+        Atomically reserve the next incident number.
+        
+        On Postgres this is a single ``UPDATE ... RETURNING`` round trip.
+        Other backends increment and read the row inside one transaction;
+        the UPDATE takes the row/write lock before the read.
+        
+        Returns:
+            int: The reserved incident number.
+        """
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        
+        if connection.vendor == "postgresql":
+            table = connection.ops.quote_name(cls._meta.db_table)
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET next_num = next_num + 1 WHERE id = 1 RETURNING next_num - 1"
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+        
+        queryset = cls.objects.using(using).filter(pk=1)
+        with transaction.atomic(using=using):
+            if queryset.update(next_num=models.F("next_num") + 1):
+                return queryset.values_list("next_num", flat=True).get() - 1
+        
+        # Counter row missing (e.g. tables created without migrations): seed it
+        start = cls.initial_value()
+        try:
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(pk=1, next_num=start + 1)
+            return start
+        except IntegrityError:
+            # Another worker seeded it first
+            with transaction.atomic(using=using):
+                queryset.update(next_num=models.F("next_num") + 1)
+                return queryset.values_list("next_num", flat=True).get() - 1
+
 
 class Incident(models.Model):
     """
@@ -102,6 +375,12 @@ class Incident(models.Model):
         unique=True,
         help_text="Public-facing incident ID returned to clients (e.g., INCIDENT-0001)",
     )
+    incident_num = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Numeric part of a sequential incident_id (INCIDENT-N)",
+    )
     status = models.CharField(
         max_length=20,
         choices=Status.choices,
@@ -116,7 +395,7 @@ class Incident(models.Model):
     session_key = models.CharField(max_length=64, null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True, db_index=True)
     user_agent = models.TextField(null=True, blank=True)
-    headers = models.JSONField(default=dict)
+    headers = JSONField(default=dict)
     body_preview = models.TextField(null=True, blank=True)
     content_type = models.CharField(max_length=255, null=True, blank=True)
     exception_class = models.CharField(max_length=255, null=True, blank=True)
@@ -127,26 +406,29 @@ class Incident(models.Model):
     notes = models.TextField(null=True, blank=True)
     
     # Tags: Use ArrayField if Postgres, otherwise CharField
-    tags = (
-        ArrayField(
-            models.CharField(max_length=100),
-            default=list,
-            blank=True,
-            size=None,
-        )
-        if ArrayField is not None
-        else models.CharField(
-            max_length=1024,
-            blank=True,
-            default="",
-        )
-    )
+    tags = tags_field()
     
     dedup_hash = models.CharField(max_length=64, db_index=True)
     occurrence_count = models.IntegerField(default=1)
 
     objects = IncidentManager()
     
+    @staticmethod
+    def parse_incident_num(incident_id: str | None) -> int | None:
+        """
+        Extract N from a sequential "INCIDENT-N" ID.
+        
+        Args:
+            incident_id: The public incident ID.
+            
+        Returns:
+            int | None: The number, or None for non-sequential IDs.
+        """
+        if not isinstance(incident_id, str):
+            return None
+        match = _INCIDENT_NUM_RE.match(incident_id)
+        return int(match.group(1)) if match else None
+
     @classmethod
     def generate_incident_id(cls) -> str:
         """
@@ -156,43 +438,23 @@ class Incident(models.Model):
             str: A sequential incident ID like "INCIDENT-0001"
         """
         try:
-            # Get the highest existing incident ID
-            last_incident = cls.objects.filter(
-                incident_id__startswith='INCIDENT-'
-            ).extra(
-                select={'num': "CAST(SPLIT_PART(incident_id, '-', 2) AS INTEGER)"}
-            ).order_by('-num').first()
-            
-            if last_incident and last_incident.incident_id.startswith('INCIDENT-'):
-                # Extract the number part
-                try:
-                    num_str = last_incident.incident_id.split('-')[1]
-                    next_num = int(num_str) + 1
-                except (ValueError, IndexError):
-                    next_num = 1
-            else:
-                next_num = 1
-            
-            return f"INCIDENT-{next_num:04d}"
+            return f"INCIDENT-{IncidentCounter.allocate():04d}"
         except Exception:
-            # Fallback: try simple ordering
-            try:
-                last = cls.objects.filter(incident_id__startswith='INCIDENT-').order_by('incident_id').last()
-                if last:
-                    num_str = last.incident_id.split('-')[1]
-                    next_num = int(num_str) + 1
-                else:
-                    next_num = 1
-                return f"INCIDENT-{next_num:04d}"
-            except Exception:
-                return f"INCIDENT-{uuid.uuid4().hex[:4].upper()}"
+            return f"INCIDENT-{uuid.uuid4().hex[:4].upper()}"
 
     class Meta:
         ordering = ["-occurred_at"]
         indexes = [
             models.Index(fields=["-occurred_at"]),
-            models.Index(fields=["dedup_hash"]),
             models.Index(fields=["status", "-occurred_at"]),
+            # Serves the create_or_increment lookup (dedup_hash + window, newest
+            # first) over open incidents only; dedup_hash keeps its own db_index
+            # for queries over closed incidents
+            models.Index(
+                fields=["dedup_hash", "-occurred_at"],
+                condition=models.Q(status="OPEN"),
+                name="bb_dedup_open_window",
+            ),
         ]
         # Partial index for open incidents (if database supports it)
         constraints = [
@@ -207,15 +469,54 @@ class Incident(models.Model):
         return f"Incident {self.incident_id} ({self.path}) - {self.status}"
 
     def save(self, *args, **kwargs):
-        """Override save to auto-set resolved_at when moving to RESOLVED."""
-        if self.status == self.Status.RESOLVED and not self.resolved_at:
-            self.resolved_at = timezone.now()
-        elif self.status != self.Status.RESOLVED and self.resolved_at:
-            # Clear resolved_at if status changes away from RESOLVED
-            self.resolved_at = None
+        """Override save to fill incident_num and auto-set resolved_at when moving to RESOLVED."""
+        if self.incident_num is None and kwargs.get("update_fields") is None:
+            self.incident_num = self.parse_incident_num(self.incident_id)
+        
+        update_fields = kwargs.get("update_fields")
+        # Partial saves that do not touch status cannot change resolved_at
+        if update_fields is None or "status" in update_fields:
+            previous = self.resolved_at
+            if self.status == self.Status.RESOLVED and not previous:
+                self.resolved_at = timezone.now()
+            elif self.status != self.Status.RESOLVED and previous:
+                # Clear resolved_at if status changes away from RESOLVED
+                self.resolved_at = None
+            if update_fields is not None and self.resolved_at != previous:
+                kwargs["update_fields"] = {*update_fields, "resolved_at"}
         super().save(*args, **kwargs)
 
 
+class RequestActivityManager(models.Manager):
+    """Manager for RequestActivity."""
+
+    def with_related(self) -> models.QuerySet:
+        """
+        Activities with their user, incident and content type joined in.
+        
+        Use this for lists that read those relations, so they do not run a
+        query per row.
+        
+        Returns:
+            QuerySet: RequestActivity queryset with select_related applied.
+        """
+        return self.select_related("user", "incident", "content_type")
+
+    def latest_for_request(self, request_id: str) -> "RequestActivity | None":
+        """
+        The most recent activity logged for a request ID.
+        
+        Served by the (request_id, -created_at) index.
+        
+        Args:
+            request_id: The X-Request-ID value.
+            
+        Returns:
+            RequestActivity | None: The newest matching activity, if any.
+        """
+        return self.filter(request_id=request_id).order_by("-created_at").first()
+
+
 class RequestActivity(models.Model):
     """
     Model to track all HTTP request/response activity with rich metadata.
@@ -239,13 +540,16 @@ class RequestActivity(models.Model):
     route_name = models.CharField(max_length=255, blank=True)
     
     # Request IDs / Correlation
-    request_id = models.CharField(max_length=64, blank=True, db_index=True)
+    # Indexed with created_at below
+    request_id = models.CharField(max_length=64, blank=True)
     incident = models.ForeignKey(
         "django_blackbox.Incident",
         null=True,
         blank=True,
         on_delete=models.SET_NULL,
         related_name="activities",
+        # Covered by the (incident, -created_at) index below
+        db_index=False,
     )
     
     # User context
@@ -274,9 +578,9 @@ class RequestActivity(models.Model):
     related_object = GenericForeignKey("content_type", "object_id")
     
     # Request & response data (JSON/text; redacted/truncated as per settings)
-    request_headers = models.JSONField(default=dict, blank=True)
+    request_headers = JSONField(default=dict, blank=True)
     request_body = models.TextField(blank=True)
-    response_headers = models.JSONField(default=dict, blank=True)
+    response_headers = JSONField(default=dict, blank=True)
     response_body = models.TextField(blank=True)
     
     # Instance state change tracking for POST/PUT/PATCH/DELETE
@@ -285,18 +589,20 @@ class RequestActivity(models.Model):
     
     # JSON snapshots of instance state BEFORE and AFTER the operation
     # (e.g. serializer data or model_to_dict output)
-    instance_before = models.JSONField(default=dict, blank=True)
-    instance_after = models.JSONField(default=dict, blank=True)
+    instance_before = JSONField(default=dict, blank=True)
+    instance_after = JSONField(default=dict, blank=True)
     
     # Optional computed diff between before/after (field -> [old, new])
-    instance_diff = models.JSONField(default=dict, blank=True)
+    instance_diff = JSONField(default=dict, blank=True)
     
     # Custom action and payload for developer-defined activities
     custom_action = models.CharField(max_length=128, blank=True)
-    custom_payload = models.JSONField(default=dict, blank=True)
+    custom_payload = JSONField(default=dict, blank=True)
     
     # Any extra metadata (e.g. tags, feature flags, etc.)
-    extra = models.JSONField(default=dict, blank=True)
+    extra = JSONField(default=dict, blank=True)
+
+    objects = RequestActivityManager()
 
     class Meta:
         ordering = ["-created_at"]
@@ -305,6 +611,10 @@ class RequestActivity(models.Model):
             models.Index(fields=["http_status"]),
             models.Index(fields=["method", "path"]),
             models.Index(fields=["user", "created_at"]),
+            # An incident's activities, newest first
+            models.Index(fields=["incident", "-created_at"], name="bb_activity_incident_recent"),
+            # Activities for a request ID, newest first
+            models.Index(fields=["request_id", "-created_at"], name="bb_activity_request_recent"),
         ]
 
     def __str__(self):
@@ -314,7 +624,10 @@ class RequestActivity(models.Model):
 # Explicit exports for public API
 __all__ = [
     "Incident",
+    "IncidentCounter",
     "RequestActivity",
     "IncidentManager",
+    "RequestActivityManager",
+    "flush_dedup_cache",
 ]
 
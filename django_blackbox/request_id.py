@@ -2,6 +2,7 @@
 Context variable management for per-request request IDs.
 Each request gets a unique identifier that's exposed via X-Request-ID header.
 """
+import os
 import uuid
 from contextvars import ContextVar
 from typing import Any
@@ -9,6 +10,10 @@ from typing import Any
 # Context variable to store the current request ID
 _request_id: ContextVar[Any] = ContextVar("django_blackbox_request_id", default=None)
 
+# Bound once: these run on every request
+_get = _request_id.get
+_set = _request_id.set
+
 
 def get_request_id() -> str | None:
     """
@@ -17,7 +22,7 @@ def get_request_id() -> str | None:
     Returns:
         str | None: The current request ID, or None if not set.
     """
-    return _request_id.get()
+    return _get()
 
 
 def set_request_id(value: str | None) -> None:
@@ -27,15 +32,29 @@ def set_request_id(value: str | None) -> None:
     Args:
         value: The request ID to set.
     """
-    _request_id.set(value)
+    _set(value)
 
 
 def new_request_id() -> str:
     """
-    Generate a new UUID4 request ID.
+    Generate a new random 128-bit request ID.
+    
+    Uses the hex form of 16 random bytes, which skips uuid.UUID construction
+    and formatting. The value is still a valid input for ``uuid.UUID``.
     
     Returns:
-        str: A new UUID string.
+        str: A new 32-character hex string.
     """
-    return str(uuid.uuid4())
+    return os.urandom(16).hex()
 
+
+def new_request_uuid() -> uuid.UUID:
+    """
+    Generate a new random request ID as a UUID object.
+    
+    For callers that store the ID in a UUIDField.
+    
+    Returns:
+        uuid.UUID: A new random UUID.
+    """
+    return uuid.UUID(bytes=os.urandom(16))
@@ -1,29 +1,33 @@
 """
 Core services for creating incidents and building error responses.
 """
+import functools
 import random
 import traceback
 import uuid
-from typing import Any
+from typing import Any, Callable
 
-from django.db import IntegrityError
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
 from django.utils import timezone
 
-from django_blackbox.conf import get_conf
+from django_blackbox import jsonutils
+from django_blackbox.conf import Config, get_conf
 from django_blackbox.models import Incident
-from django_blackbox.request_id import get_request_id, new_request_id
+from django_blackbox.request_id import get_request_id, new_request_uuid
 from django_blackbox.utils import (
+    BODY_READ_LIMIT_FACTOR,
     collect_request_meta,
     compute_signature,
     extract_ip_address,
+    request_state,
     resolve_user,
     safe_log_to_file,
     should_capture_status_code,
 )
 
 
-def _json_500(message: str, incident_id: str | None, status: int = 500) -> JsonResponse:
+def _json_500(message: str, incident_id: str | None, status: int = 500, *, config: Config | None = None) -> HttpResponse:
     """
     Build a JSON 500 error response.
     
@@ -31,11 +35,13 @@ def _json_500(message: str, incident_id: str | None, status: int = 500) -> JsonR
         message: The error message to display.
         incident_id: The incident ID to include in the response.
         status: The HTTP status code.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
-        JsonResponse: A JSON error response.
+        HttpResponse: A JSON error response.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Determine response status
     response_status = status
@@ -43,32 +49,71 @@ def _json_500(message: str, incident_id: str | None, status: int = 500) -> JsonR
         response_status = 400
     
     # Build response body
+    iid = str(incident_id) if incident_id else None
     if config.CUSTOM_ERROR_FORMAT:
-        # Use custom error format if configured
-        body = config.CUSTOM_ERROR_FORMAT.copy()
-        # Replace placeholder with incident_id
-        for key, value in body.items():
-            if isinstance(value, str) and incident_id:
-                body[key] = value.replace('<incident_id>', str(incident_id))
-            if '<incident_id>' in str(value) and incident_id:
-                body[key] = str(value).replace('<incident_id>', str(incident_id))
+        # Use custom error format if configured, replacing the placeholder in
+        # string values (skipped when the format has none)
+        if iid and config._custom_error_has_placeholder:
+            body = {
+                key: value.replace("<incident_id>", iid) if isinstance(value, str) else value
+                for key, value in config.CUSTOM_ERROR_FORMAT.items()
+            }
+        else:
+            body = config.CUSTOM_ERROR_FORMAT.copy()
         # Add incident_id to the body
-        if "incident_id" not in body and incident_id:
-            body["incident_id"] = str(incident_id)
+        if "incident_id" not in body and iid:
+            body["incident_id"] = iid
     else:
         # Default format
         body: dict[str, Any] = {"detail": message}
         
-        if config.INCLUDE_INCIDENT_ID_IN_BODY and incident_id:
-            body["incident_id"] = str(incident_id)
+        if config.INCLUDE_INCIDENT_ID_IN_BODY and iid:
+            body["incident_id"] = iid
+    
+    return HttpResponse(
+        # DjangoJSONEncoder covers lazy translation strings, as JsonResponse did
+        jsonutils.dumps_bytes(body, default=DjangoJSONEncoder().default),
+        content_type="application/json",
+        status=response_status,
+    )
+
+
+def _format_stacktrace(exc: BaseException, limit: int | None) -> str:
+    """
+    Format an exception and its traceback as a string.
+    
+    Args:
+        exc: The exception.
+        limit: Maximum number of frames (None for all).
+        
+    Returns:
+        str: The formatted traceback.
+    """
+    return "".join(traceback.format_exception(type(exc), exc, exc.__traceback__, limit=limit))
+
+
+def _mark_incident_created(request: Any, incident: Any) -> None:
+    """
+    Flag the request as handled and keep the incident for activity logging.
     
-    return JsonResponse(body, status=response_status)
+    ActivityLoggingMiddleware links its RequestActivity row to this incident
+    without having to look it up again by request ID.
+    
+    Args:
+        request: The Django request object.
+        incident: The persisted incident (or fallback namespace).
+    """
+    state = request_state(request)
+    state["incident_created"] = True
+    state["incident"] = incident
 
 
 def _should_capture(
     request: Any,
     exception_class: str | None = None,
     http_status: int | None = None,
+    *,
+    config: Config | None = None,
 ) -> bool:
     """
     Determine if an incident should be captured based on configuration.
@@ -77,33 +122,34 @@ def _should_capture(
         request: The Django request object.
         exception_class: The exception class name (if any).
         http_status: The HTTP status code (if any).
+        config: Config to use (defaults to get_conf()).
         
     Returns:
         bool: True if the incident should be captured.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Check if enabled
     if not config.ENABLED:
         return False
     
     # Check if path should be ignored
-    for pattern in config._compiled_ignore_paths:
-        if pattern.search(request.path):
-            return False
+    ignore_re = config.ignore_paths_re
+    if ignore_re is not None and ignore_re.search(request.path):
+        return False
     
     # Check if exception should be ignored
-    if exception_class:
-        for ignored in config.IGNORE_EXCEPTIONS:
-            if exception_class.startswith(ignored):
-                return False
+    if exception_class and exception_class.startswith(config._compiled_ignore_exceptions):
+        return False
     
     # Check HTTP status (only capture 5xx)
     if http_status is not None and not (500 <= http_status < 600):
         return False
     
     # Check sampling rate
-    if random.random() >= config.SAMPLE_RATE:
+    # The default rate of 1.0 always captures; only draw a number when sampling
+    if config.SAMPLE_RATE < 1.0 and random.random() >= config.SAMPLE_RATE:
         return False
     
     return True
@@ -114,8 +160,10 @@ def safe_persist_incident(
     http_status: int,
     exception_class: str | None,
     exception_message: str | None,
-    stacktrace: str | None,
+    stacktrace: str | Callable[[], str | None] | None,
     dedup_hash: str,
+    *,
+    config: Config | None = None,
 ) -> Incident:
     """
     Safely persist an incident to the database with fallback logging.
@@ -125,23 +173,26 @@ def safe_persist_incident(
         http_status: The HTTP status code.
         exception_class: The exception class name (or None).
         exception_message: The exception message (or None).
-        stacktrace: The stacktrace (or None).
+        stacktrace: The stacktrace, a callable returning it (called only
+            when a new incident is created), or None.
         dedup_hash: The deduplication hash.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
         Incident: The created or updated incident.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Get request ID from meta or generate new one
-    request_id_str = meta.get("request_id") or new_request_id()
+    request_id_str = meta.get("request_id")
     try:
-        request_id = uuid.UUID(request_id_str)
+        request_id = uuid.UUID(request_id_str) if request_id_str else new_request_uuid()
     except (ValueError, TypeError):
-        request_id = uuid.uuid4()
+        request_id = new_request_uuid()
     
-    # incident_id is generated inside create_or_increment when creating (to avoid races)
-    incident_id = Incident.generate_incident_id()
+    # incident_id is allocated inside create_or_increment, only when a new
+    # incident is actually created
 
     # If no stacktrace but we have an exception message that looks like a stacktrace,
     # make sure it's stored in the stacktrace field
@@ -151,7 +202,6 @@ def safe_persist_incident(
     # Prepare defaults for create_or_increment
     defaults = {
         "request_id": request_id,
-        "incident_id": incident_id,
         "status": Incident.Status.OPEN,
         "http_status": http_status,
         "method": meta.get("method", "GET"),
@@ -173,25 +223,20 @@ def safe_persist_incident(
     }
     
     try:
-        max_attempts = 3
-        for attempt in range(max_attempts):
-            try:
-                incident, created = Incident.objects.create_or_increment(
-                    signature=dedup_hash,
-                    defaults=defaults,
-                    window_seconds=config.DEDUP_WINDOW_SECONDS,
-                )
-                return incident
-            except IntegrityError as e:
-                # Duplicate incident_id (race): retry; manager generates id inside transaction
-                if "incident_id" in str(e) and attempt < max_attempts - 1:
-                    continue
-                raise
+        # incident_id comes from the atomic IncidentCounter, so concurrent
+        # creates cannot collide on it and there is nothing to retry
+        incident, created = Incident.objects.create_or_increment(
+            signature=dedup_hash,
+            defaults=defaults,
+            window_seconds=config.DEDUP_WINDOW_SECONDS,
+        )
+        return incident
     except Exception as e:
         # Fallback logging
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Failed to persist incident to database: {e}")
+        incident_id = Incident.generate_incident_id()
         
         # Log to file
         safe_log_to_file({
@@ -202,7 +247,7 @@ def safe_persist_incident(
             "exception_class": exception_class,
             "exception_message": exception_message,
             "persist_error": str(e),
-        })
+        }, config=config)
         
         # Return a minimal incident-like object
         from types import SimpleNamespace
@@ -212,50 +257,89 @@ def safe_persist_incident(
         return incident
 
 
-def log_exception_and_build_response(request: Any, exc: Exception) -> JsonResponse | None:
+def _record_incident(
+    request: Any,
+    http_status: int,
+    exception_class: str | None,
+    exception_message: str | None,
+    stacktrace: str | Callable[[], str | None] | None,
+    *,
+    config: Config,
+) -> Incident:
+    """
+    Record an incident for a request, counting it in memory when possible.
+    
+    A signature seen within DEDUP_COALESCE_SECONDS is counted without
+    collecting (and redacting) the request metadata, which only a database
+    write needs.
+    
+    Args:
+        request: The Django request object.
+        http_status: The HTTP status code.
+        exception_class: The exception class name (or None).
+        exception_message: The exception message (or None).
+        stacktrace: The stacktrace, a callable returning it, or None.
+        config: Config to use.
+        
+    Returns:
+        Incident: The created or updated incident (or fallback namespace).
+    """
+    signature = compute_signature(exception_class, request.path, exception_message or "", config=config)
+    incident = Incident.objects.increment_coalesced(signature)
+    if incident is not None:
+        return incident
+    
+    return safe_persist_incident(
+        meta=collect_request_meta(request, config=config),
+        http_status=http_status,
+        exception_class=exception_class,
+        exception_message=exception_message,
+        stacktrace=stacktrace,
+        dedup_hash=signature,
+        config=config,
+    )
+
+
+def log_exception_and_build_response(
+    request: Any,
+    exc: Exception,
+    *,
+    config: Config | None = None,
+) -> HttpResponse | None:
     """
     Log an exception as an incident and build an appropriate response.
     
     Args:
         request: The Django request object.
         exc: The exception that occurred.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
-        JsonResponse | None: A JSON response if configured, None otherwise.
+        HttpResponse | None: A JSON response if configured, None otherwise.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Check if we should capture this
     exception_class = f"{exc.__class__.__module__}.{exc.__class__.__name__}"
-    if not _should_capture(request, exception_class=exception_class):
+    if not _should_capture(request, exception_class=exception_class, config=config):
         return None
     
-    # Collect metadata
-    meta = collect_request_meta(request)
-    
     # Capture exception details
     exception_message = str(exc) if exc else None
     stacktrace = None
     if config.CAPTURE_STACKTRACE:
-        stacktrace = "".join(
-            traceback.format_exception(type(exc), exc, exc.__traceback__)
-        )
-    
-    # Compute signature
-    signature = compute_signature(exception_class, meta["path"], exception_message or "")
+        # Formatted only if a new incident is created, not on a dedup hit
+        stacktrace = functools.partial(_format_stacktrace, exc, config.MAX_STACK_FRAMES)
     
     # Persist incident
-    incident = safe_persist_incident(
-        meta=meta,
-        http_status=500,
-        exception_class=exception_class,
-        exception_message=exception_message,
-        stacktrace=stacktrace,
-        dedup_hash=signature,
+    incident = _record_incident(
+        request, 500, exception_class, exception_message, stacktrace, config=config
     )
+    request_id = get_request_id()
     
     # Mark that we've created an incident for this request
-    request._django_blackbox_incident_created = True
+    _mark_incident_created(request, incident)
     
     # If RETURN_400_INSTEAD_OF_500 is enabled, always return a response
     if config.RETURN_400_INSTEAD_OF_500:
@@ -263,12 +347,13 @@ def log_exception_and_build_response(request: Any, exc: Exception) -> JsonRespon
         resp = _json_500(
             config.GENERIC_ERROR_MESSAGE, 
             incident.incident_id, 
-            status=500
+            status=500,
+            config=config,
         )
         
         # Add headers
-        if config.ADD_REQUEST_ID_HEADER and meta["request_id"]:
-            resp["X-Request-ID"] = meta["request_id"]
+        if config.ADD_REQUEST_ID_HEADER and request_id:
+            resp["X-Request-ID"] = request_id
         if config.ADD_INCIDENT_ID_HEADER:
             resp["X-Incident-ID"] = incident.incident_id
         
@@ -280,53 +365,62 @@ def log_exception_and_build_response(request: Any, exc: Exception) -> JsonRespon
     
     # Check if JSON is appropriate
     accept = request.META.get("HTTP_ACCEPT", "")
-    is_json_request = "application/json" in accept.lower()
+    # Clients almost always send the lowercase form; only lowercase otherwise
+    is_json_request = "application/json" in accept or "application/json" in accept.lower()
     
     if not is_json_request:
         return None
     
     # Build JSON response
-    resp = _json_500(config.GENERIC_ERROR_MESSAGE, incident.incident_id, status=500)
+    resp = _json_500(config.GENERIC_ERROR_MESSAGE, incident.incident_id, status=500, config=config)
     
     # Add headers
-    if config.ADD_REQUEST_ID_HEADER and meta["request_id"]:
-        resp["X-Request-ID"] = meta["request_id"]
+    if config.ADD_REQUEST_ID_HEADER and request_id:
+        resp["X-Request-ID"] = request_id
     if config.ADD_INCIDENT_ID_HEADER:
         resp["X-Incident-ID"] = incident.incident_id
     
     return resp
 
 
-def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
+def log_5xx_response_and_decorate(
+    request: Any,
+    response: Any,
+    *,
+    config: Config | None = None,
+) -> Any:
     """
     Log a 5xx HTTP response and decorate with headers.
     
     Args:
         request: The Django request object.
         response: The HTTP response object.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
         Any: The response with added headers or custom response if configured.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Check if enabled
     if not config.ENABLED:
         return response
     
     # Skip if incident was already created
-    if hasattr(request, '_django_blackbox_incident_created'):
+    state = request_state(request)
+    if state["incident_created"]:
         return response
     
     # Check status code
     status_code = getattr(response, "status_code", 200)
     
     # Check if this status code should be captured based on configuration
-    if not should_capture_status_code(status_code):
+    if not should_capture_status_code(status_code, config=config):
         return response
     
     # Check if we should capture this (sample rate, ignore paths, etc.)
-    if not _should_capture(request, http_status=status_code):
+    if not _should_capture(request, http_status=status_code, config=config):
         return response
     
     # Only capture if explicitly enabled
@@ -338,9 +432,6 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
                 response["X-Request-ID"] = rid
         return response
     
-    # Collect metadata
-    meta = collect_request_meta(request)
-    
     # Try to get exception info from request (stored in process_exception)
     exception_class = None
     exception_message = f"HTTP {status_code}"
@@ -348,27 +439,17 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
     original_message = None
     
     # Check if we have stored exception info on the request
-    if hasattr(request, '_django_blackbox_exception_info'):
-        import traceback
-        exc_type, exc_value, exc_tb = request._django_blackbox_exception_info
+    # (type, message, frame-free TracebackException) from process_exception
+    if state["exc_info"] is not None:
+        exc_type, exc_message, tb_exception = state["exc_info"]
         if exc_type is not None:
             exception_class = f"{exc_type.__module__}.{exc_type.__name__}"
-            exception_message = str(exc_value) if exc_value else f"HTTP {status_code}"
+            exception_message = exc_message or f"HTTP {status_code}"
             original_message = exception_message
-            if exc_tb is not None:
-                stacktrace = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
+            if tb_exception is not None:
+                stacktrace = "".join(tb_exception.format())
     
     # If no stored exception, try to extract exception details from the response body
-    except_type_from_request = None
-    if hasattr(request, '_django_blackbox_exception_info'):
-        try:
-            import sys
-            exc_info = sys.exc_info()
-            if exc_info[0] is not None:
-                except_type_from_request = f"{exc_info[0].__module__}.{exc_info[0].__name__}"
-        except:
-            pass
-    
     try:
         # Try to get the response content
         if hasattr(response, 'data') and isinstance(response.data, dict):
@@ -380,12 +461,24 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
             # Check if stacktrace was included in the response
             if 'stacktrace' in response.data:
                 stacktrace = response.data['stacktrace']
-        elif hasattr(response, 'content'):
-            # Try to decode JSON from content
-            import json
-            try:
-                content = response.content.decode('utf-8')
-                data = json.loads(content)
+        elif (
+            not getattr(response, 'streaming', False)
+            and hasattr(response, 'content')
+            and len(response.content) <= config.MAX_BODY_BYTES * BODY_READ_LIMIT_FACTOR
+        ):
+            # Try to decode JSON from content. Very large bodies (exports, pages)
+            # are skipped rather than decoded in full just to look for a message;
+            # error bodies with a stacktrace easily exceed MAX_BODY_BYTES itself.
+            raw_content = response.content
+            data = None
+            # Only JSON responses are parsed; HTML/text error pages would just
+            # raise (and pay for) a decode error
+            if 'json' in (response.get('Content-Type') or ''):
+                try:
+                    data = jsonutils.loads(raw_content)
+                except ValueError:
+                    data = None
+            if data is not None:
                 detail = data.get('detail', '')
                 if detail and detail != config.GENERIC_ERROR_MESSAGE:
                     exception_message = detail
@@ -400,10 +493,11 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
                             exception_message = str(data[key])
                             original_message = str(data[key])
                             break
-            except (UnicodeDecodeError, json.JSONDecodeError):
-                # Not JSON, try as plain text
-                if response.content:
-                    content = response.content.decode('utf-8', errors='ignore')
+            else:
+                # Not JSON, try as plain text. 1000 characters are at most 4000
+                # UTF-8 bytes, so longer bodies are not decoded at all.
+                if raw_content and len(raw_content) < 4000:
+                    content = raw_content.decode('utf-8', errors='ignore')
                     if len(content) < 1000:  # Only use if reasonable size
                         exception_message = content
                         original_message = content
@@ -413,10 +507,7 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
     
     # Try to infer exception class from message if not already set
     if not exception_class:
-        # First check if we have it from request
-        if except_type_from_request:
-            exception_class = except_type_from_request
-        elif exception_message:
+        if exception_message:
             # Try to extract the exception type from the message
             if "'" in exception_message and "object has no attribute" in exception_message:
                 exception_class = "builtins.AttributeError"
@@ -428,21 +519,14 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
     if stacktrace and not original_message:
         exception_message = stacktrace
     
-    # Compute signature using extracted message
-    signature = compute_signature(exception_class, meta["path"], exception_message)
-    
-    # Persist incident
-    incident = safe_persist_incident(
-        meta=meta,
-        http_status=status_code,
-        exception_class=exception_class,
-        exception_message=exception_message,
-        stacktrace=stacktrace,
-        dedup_hash=signature,
+    # Persist incident (the signature uses the extracted message)
+    incident = _record_incident(
+        request, status_code, exception_class, exception_message, stacktrace, config=config
     )
+    request_id = get_request_id()
     
     # Mark that we've created an incident for this request
-    request._django_blackbox_incident_created = True
+    _mark_incident_created(request, incident)
     
     # If we need to return 400 instead of 500, replace the response
     if config.RETURN_400_INSTEAD_OF_500:
@@ -450,18 +534,19 @@ def log_5xx_response_and_decorate(request: Any, response: Any) -> Any:
         resp = _json_500(
             config.GENERIC_ERROR_MESSAGE,
             incident.incident_id,
-            status=500
+            status=500,
+            config=config,
         )
         # Add headers
-        if config.ADD_REQUEST_ID_HEADER and meta["request_id"]:
-            resp["X-Request-ID"] = meta["request_id"]
+        if config.ADD_REQUEST_ID_HEADER and request_id:
+            resp["X-Request-ID"] = request_id
         if config.ADD_INCIDENT_ID_HEADER:
             resp["X-Incident-ID"] = incident.incident_id
         return resp
     
     # Otherwise just add headers
-    if config.ADD_REQUEST_ID_HEADER and meta["request_id"]:
-        response["X-Request-ID"] = meta["request_id"]
+    if config.ADD_REQUEST_ID_HEADER and request_id:
+        response["X-Request-ID"] = request_id
     if config.ADD_INCIDENT_ID_HEADER:
         response["X-Incident-ID"] = incident.incident_id
     
@@ -3,12 +3,14 @@ Utility functions for redaction, hashing, metadata collection, and fallback logg
 """
 import datetime
 import decimal
+import functools
 import hashlib
-import json
+import io
 import logging
 import re
 import traceback
 import uuid
+from collections.abc import Iterable, Iterator, Mapping
 from datetime import timedelta
 from ipaddress import ip_address
 from typing import Any
@@ -17,71 +19,144 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.http import HttpRequest
 from django.utils import timezone
+from django.utils.module_loading import import_string
 
-from django_blackbox.conf import get_conf
+from django_blackbox import jsonutils
+from django_blackbox.conf import Config, get_conf
 from django_blackbox.request_id import get_request_id
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# normalize_message: UUIDs, long numeric IDs (5+ digits) and IPv4 addresses,
+# replaced in a single pass
+_NORMALIZE_RE = re.compile(
+    r"(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
+    r"|(?P<id>\b\d{5,}\b)"
+    r"|(?P<ip>\b(?:\d{1,3}\.){3}\d{1,3}\b)",
+    re.IGNORECASE,
+)
+_NORMALIZE_PLACEHOLDERS = {"uuid": "<UUID>", "id": "<ID>", "ip": "<IP>"}
 
-def should_capture_status_code(status_code: int) -> bool:
+# Messages longer than this are hashed without memoization
+_SIGNATURE_MEMO_MAX_MESSAGE = 1024
+
+# Dotted-quad IPv4 without leading zeros (as accepted by ipaddress)
+_IPV4_OCTET = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_IPV4_RE = re.compile(rf"{_IPV4_OCTET}(?:\.{_IPV4_OCTET}){{3}}")
+
+# Unread request bodies larger than this multiple of MAX_BODY_BYTES are not
+# loaded just to build a preview (redaction needs the whole JSON document,
+# so some headroom over MAX_BODY_BYTES is kept)
+BODY_READ_LIMIT_FACTOR = 16
+
+# JSON bodies this many times larger than max_bytes are re-encoded chunk by
+# chunk, stopping at max_bytes, rather than serialized whole and sliced
+_CAPPED_ENCODE_RATIO = 8
+
+
+def request_state(request: Any) -> dict[str, Any]:
+    """
+    Get the per-request django_blackbox state dict.
+    
+    All private per-request flags live in one dict stored on the request,
+    created on first access:
+    
+    - raw_body: Raw body cached by BodyCaptureMiddleware.
+    - rid_uuid: Parsed UUID of a generated request ID.
+    - exc_info: (type, message, TracebackException) from process_exception.
+    - incident_created: Whether an incident was recorded for this request.
+    - incident: The recorded incident (or fallback namespace).
+    - start_time: perf_counter_ns() start time for activity logging.
+    
+    DRF's Request wrapper is unwrapped so middlewares and the DRF exception
+    handler share the same state.
+    
+    Args:
+        request: The Django (or DRF) request object.
+        
+    Returns:
+        dict: The mutable state dict for this request.
+    """
+    request = getattr(request, "_request", request)
+    state = request.__dict__.get("_django_blackbox")
+    if state is None:
+        state = request.__dict__["_django_blackbox"] = {
+            "raw_body": None,
+            "rid_uuid": None,
+            "exc_info": None,
+            "incident_created": False,
+            "incident": None,
+            "start_time": 0,
+        }
+    return state
+
+
+def should_capture_status_code(status_code: int, *, config: Config | None = None) -> bool:
     """
     Check if a status code should trigger incident capture.
     
     Args:
         status_code: The HTTP status code to check.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
         bool: True if the status code should trigger incident capture.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     if not config.ENABLED:
         return False
     
-    # Check if status code matches any configured capture rules
-    for rule in config.CAPTURE_STATUS_CODES:
-        if isinstance(rule, tuple):
-            # Range: (start, end)
-            start, end = rule
-            if start <= status_code <= end:
-                return True
-        elif isinstance(rule, int):
-            # Specific code
-            if status_code == rule:
-                return True
+    # Specific codes, then (start, end) ranges, as split by Config
+    if status_code in config._capture_status_codes:
+        return True
+    for start, end in config._capture_status_ranges:
+        if start <= status_code <= end:
+            return True
     
     return False
 
 
-def redact_headers(headers: dict[str, Any], keys: list[str], mask: str) -> dict[str, Any]:
+def redact_headers(
+    headers: Mapping[str, Any] | Iterable[tuple[str, Any]],
+    keys: Iterable[str],
+    mask: str,
+) -> dict[str, Any]:
     """
     Redact sensitive header values.
     
     Args:
-        headers: The headers dict to redact.
-        keys: List of header keys to redact (case-insensitive).
+        headers: The headers to redact, as a mapping or an iterable of
+            (name, value) pairs (so callers need not build a dict first).
+        keys: Header keys to redact (case-insensitive). A frozenset is
+            taken to be casefolded already (e.g. Config.redact_headers_set).
         mask: The string to use as replacement.
         
     Returns:
         dict: A new dict with redacted values.
     """
-    redacted = {}
-    keys_lower = {k.lower() for k in keys}
+    # casefold() rather than lower() so non-ASCII names compare correctly too
+    keys_folded = _folded_set(keys)
+    pairs = headers.items() if isinstance(headers, Mapping) else headers
     
-    for key, value in headers.items():
-        if key.lower() in keys_lower:
-            redacted[key] = mask
-        else:
-            redacted[key] = value
-    
-    return redacted
+    return {
+        key: mask if key.casefold() in keys_folded else value
+        for key, value in pairs
+    }
+
+
+def _folded_set(names: Iterable[str]) -> frozenset[str]:
+    """Casefold names into a frozenset; a frozenset is returned as is."""
+    if isinstance(names, frozenset):
+        return names
+    return frozenset(n.casefold() for n in names)
 
 
 def redact_body(
     payload: bytes | str | dict | Any,
-    fields: list[str],
+    fields: Iterable[str],
     mask: str,
     max_bytes: int,
     content_type: str | None,
@@ -91,7 +166,8 @@ def redact_body(
     
     Args:
         payload: The body content (bytes, str, or dict).
-        fields: List of field names to redact.
+        fields: Field names to redact (case-insensitive). A frozenset is
+            taken to be casefolded already (e.g. Config.redact_fields_set).
         mask: The string to use as replacement.
         max_bytes: Maximum bytes to store.
         content_type: The content type of the body.
@@ -99,8 +175,17 @@ def redact_body(
     Returns:
         str: The redacted and truncated body as a string.
     """
+    fields = _folded_set(fields)
+    if not fields:
+        # Nothing to redact: skip JSON parsing and only truncate
+        content_type = None
+    
     # Handle bytes
     if isinstance(payload, bytes):
+        if content_type and "json" in content_type and not _may_contain_field(payload, fields):
+            # No field name (nor any JSON escape that could spell one) occurs in
+            # the raw bytes, so parsing could not redact anything: just truncate
+            content_type = None
         try:
             text = payload.decode("utf-8")
             return _redact_text_body(text, fields, mask, max_bytes, content_type)
@@ -121,16 +206,130 @@ def redact_body(
     return text[:max_bytes] if len(text) <= max_bytes else text[:max_bytes] + "..."
 
 
-def _redact_text_body(text: str, fields: list[str], mask: str, max_bytes: int, content_type: str | None) -> str:
+def redact_body_to_stream(
+    payload: bytes | str | dict | Any,
+    fp: Any,
+    fields: Iterable[str],
+    mask: str,
+    max_bytes: int,
+    content_type: str | None,
+) -> int:
+    """
+    Redact and truncate a body like redact_body(), writing it to a binary stream.
+    
+    JSON bodies are encoded in chunks and writing stops once max_bytes is
+    reached, so the serialized body is never held in memory as a whole.
+    
+    Args:
+        payload: The body content (bytes, str, or dict).
+        fp: Binary file-like object to write to.
+        fields: Field names to redact (case-insensitive).
+        mask: The string to use as replacement.
+        max_bytes: Maximum bytes to write (plus "..." when truncated).
+        content_type: The content type of the body.
+        
+    Returns:
+        int: The number of bytes written.
+    """
+    fields = _folded_set(fields)
+    data = None
+    if isinstance(payload, dict):
+        data = payload
+    elif fields and content_type and "json" in content_type and isinstance(payload, (bytes, str)):
+        raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+        if _may_contain_field(raw, fields):
+            try:
+                parsed = jsonutils.loads(raw)
+            except (ValueError, TypeError):
+                parsed = None
+            if isinstance(parsed, dict):
+                data = parsed
+    
+    if data is None:
+        encoded = redact_body(payload, fields, mask, max_bytes, content_type).encode("utf-8")
+        fp.write(encoded)
+        return len(encoded)
+    
+    redacted = _redact_dict_recursive(data, fields, mask) if fields else data
+    return _write_json_capped(redacted, fp, max_bytes)
+
+
+def _write_json_capped(obj: Any, fp: Any, max_bytes: int) -> int:
+    """
+    Write obj as JSON to fp, stopping after max_bytes and appending "...".
+    
+    Args:
+        obj: Object to encode (values it cannot encode are written via str()).
+        fp: Binary file-like object to write to.
+        max_bytes: Maximum bytes of JSON to write.
+        
+    Returns:
+        int: The number of bytes written.
+    """
+    written = 0
+    for chunk in jsonutils.iterencode(obj, default=str):
+        data = chunk.encode("utf-8")
+        if written + len(data) > max_bytes:
+            # Cut at a character boundary, as the other truncation paths do
+            data = data[:max_bytes - written].decode("utf-8", errors="ignore").encode("utf-8") + b"..."
+            fp.write(data)
+            return written + len(data)
+        fp.write(data)
+        written += len(data)
+    return written
+
+
+def _may_contain_field(raw: bytes, fields: frozenset[str]) -> bool:
+    """
+    Check whether parsing a raw JSON body could find a key to redact.
+    
+    The bytes pre-scan only folds ASCII case, while keys are compared with
+    casefold(), so it is trusted only when both the field names and the body
+    are ASCII (a non-ASCII key such as "paßword" can casefold to an ASCII
+    name). Otherwise the body is always parsed.
+    
+    Args:
+        raw: The raw JSON body.
+        fields: Casefolded field names to redact.
+        
+    Returns:
+        bool: False only if no field name can occur in the body.
+    """
+    if not raw.isascii() or not all(f.isascii() for f in fields):
+        return True
+    return _field_name_pattern(fields).search(raw) is not None
+
+
+@functools.lru_cache(maxsize=8)
+def _field_name_pattern(fields: frozenset[str]) -> re.Pattern[bytes]:
+    """
+    Build a case-insensitive bytes pattern matching any field name or a backslash.
+    
+    Args:
+        fields: Field names to redact.
+        
+    Returns:
+        re.Pattern: Pattern that finds any place a redactable key could occur.
+    """
+    alternatives = [re.escape(f.encode("utf-8")) for f in fields if f]
+    alternatives.append(re.escape(b"\\"))
+    return re.compile(b"|".join(alternatives), re.IGNORECASE)
+
+
+def _redact_text_body(text: str, fields: frozenset[str], mask: str, max_bytes: int, content_type: str | None) -> str:
     """Redact text body based on content type."""
     if content_type and "json" in content_type:
         try:
-            obj = json.loads(text)
+            obj = jsonutils.loads(text)
             if isinstance(obj, dict):
-                return _redact_dict_body(obj, fields, mask, max_bytes)
-        except (json.JSONDecodeError, TypeError):
+                capped = len(text) > max_bytes * _CAPPED_ENCODE_RATIO
+                return _redact_dict_body(obj, fields, mask, max_bytes, capped=capped)
+        except (ValueError, TypeError):
             pass
     
+    # A UTF-8 character is at most 4 bytes, so short text fits without encoding
+    if len(text) * 4 <= max_bytes:
+        return text
     text_encoded = text.encode("utf-8")
     if len(text_encoded) <= max_bytes:
         return text
@@ -139,34 +338,79 @@ def _redact_text_body(text: str, fields: list[str], mask: str, max_bytes: int, c
     return truncated + "..."
 
 
-def _redact_dict_body(data: Any, fields: list[str], mask: str, max_bytes: int) -> str:
-    """Recursively redact dict values and return as JSON string."""
+def _redact_dict_body(data: Any, fields: frozenset[str], mask: str, max_bytes: int, capped: bool = False) -> str:
+    """
+    Redact dict values (at any depth) and return as JSON string.
+    
+    With capped=True, encoding stops once max_bytes is reached instead of
+    serializing the whole body (slower per byte, but bounded by max_bytes).
+    """
     if not isinstance(data, dict):
         return str(data)
     
-    redacted = _redact_dict_recursive(data, fields, mask)
+    redacted = _redact_dict_recursive(data, fields, mask) if fields else data
+    
+    if capped:
+        buf = io.BytesIO()
+        _write_json_capped(redacted, buf, max_bytes)
+        return buf.getvalue().decode("utf-8")
     
     try:
-        json_str = json.dumps(redacted, separators=(",", ":"))
-        if len(json_str.encode("utf-8")) <= max_bytes:
-            return json_str
-        truncated = json_str.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+        json_bytes = jsonutils.dumps_bytes(redacted)
+        if len(json_bytes) <= max_bytes:
+            return json_bytes.decode("utf-8")
+        truncated = json_bytes[:max_bytes].decode("utf-8", errors="ignore")
         return truncated + "..."
     except (TypeError, ValueError):
         return str(redacted)[:max_bytes]
 
 
-def _redact_dict_recursive(obj: Any, fields: list[str], mask: str) -> Any:
-    """Recursively traverse and redact dictionary values."""
-    if isinstance(obj, dict):
-        return {
-            key: mask if key.lower() in [f.lower() for f in fields] else _redact_dict_recursive(value, fields, mask)
-            for key, value in obj.items()
-        }
-    elif isinstance(obj, list):
-        return [_redact_dict_recursive(item, fields, mask) for item in obj]
-    else:
+def _redact_dict_recursive(obj: Any, fields: frozenset[str], mask: str) -> Any:
+    """
+    Return obj with the values of matching keys replaced by mask.
+    
+    Only the containers on the path to a redacted key are copied; untouched
+    subtrees are shared with obj, which is never modified. Nested dicts and
+    lists are walked with an explicit stack rather than recursion, so deeply
+    nested bodies cannot hit the recursion limit.
+    
+    Args:
+        obj: Parsed JSON value.
+        fields: Casefolded field names to redact.
+        mask: The string to use as replacement.
+        
+    Returns:
+        Any: The redacted value (obj itself if nothing was redacted).
+    """
+    if not isinstance(obj, (dict, list)):
         return obj
+    
+    # Frames are (container, remaining items, replacements, key in parent)
+    stack = [(obj, _container_items(obj), {}, None)]
+    while True:
+        node, items, changes, parent_key = stack[-1]
+        is_dict = isinstance(node, dict)
+        for key, value in items:
+            if is_dict and key.casefold() in fields:
+                changes[key] = mask
+            elif value and isinstance(value, (dict, list)):
+                stack.append((value, _container_items(value), {}, key))
+                break
+        else:
+            stack.pop()
+            if changes:
+                node = dict(node) if is_dict else list(node)
+                for key, value in changes.items():
+                    node[key] = value
+            if not stack:
+                return node
+            if changes:
+                stack[-1][2][parent_key] = node
+
+
+def _container_items(node: dict | list) -> Iterator[tuple[Any, Any]]:
+    """Iterate (key, value) pairs of a dict or (index, item) pairs of a list."""
+    return iter(node.items()) if isinstance(node, dict) else enumerate(node)
 
 
 def normalize_message(message: str) -> str:
@@ -179,28 +423,16 @@ def normalize_message(message: str) -> str:
     Returns:
         str: The normalized message.
     """
-    # Replace UUIDs with placeholder
-    message = re.sub(
-        r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
-        "<UUID>",
-        message,
-        flags=re.IGNORECASE,
-    )
-    
-    # Replace long numeric IDs (more than 4 digits)
-    message = re.sub(r"\b\d{5,}\b", "<ID>", message)
-    
-    # Replace IP addresses
-    try:
-        ip_pattern = r"\b(?:\d{1,3}\.){3}\d{1,3}\b"
-        message = re.sub(ip_pattern, "<IP>", message)
-    except re.error:
-        pass
-    
-    return message
+    return _NORMALIZE_RE.sub(lambda m: _NORMALIZE_PLACEHOLDERS[m.lastgroup], message)
 
 
-def compute_signature(exception_class: str | None, path: str, message: str) -> str:
+def compute_signature(
+    exception_class: str | None,
+    path: str,
+    message: str,
+    *,
+    config: Config | None = None,
+) -> str:
     """
     Compute a deduplication signature for an incident.
     
@@ -208,13 +440,32 @@ def compute_signature(exception_class: str | None, path: str, message: str) -> s
         exception_class: The exception class name (or None).
         path: The request path.
         message: The exception message (or status code message).
+        config: Config to use (defaults to get_conf()).
         
     Returns:
-        str: A SHA256 hex digest of the signature.
+        str: A hex digest of the signature: 32 characters for blake2b-128
+            (the default), 64 for SIGNATURE_HASH = "sha256".
     """
+    if config is None:
+        config = get_conf()
+    
+    # Repeats of one error share (class, path, message); memoize those, but
+    # not long messages (e.g. stacktraces used as the message)
+    if len(message) <= _SIGNATURE_MEMO_MAX_MESSAGE:
+        return _signature_cached(exception_class, path, message, config.SIGNATURE_HASH)
+    return _signature_impl(exception_class, path, message, config.SIGNATURE_HASH)
+
+
+def _signature_impl(exception_class: str | None, path: str, message: str, hash_name: str) -> str:
+    """Normalize the message and hash the signature string (see compute_signature)."""
     normalized_msg = normalize_message(message)
-    signature_str = f"{exception_class or 'HTTP5xx'}|{path}|{normalized_msg}"
-    return hashlib.sha256(signature_str.encode("utf-8")).hexdigest()
+    signature_bytes = f"{exception_class or 'HTTP5xx'}|{path}|{normalized_msg}".encode("utf-8")
+    if hash_name == "sha256":
+        return hashlib.sha256(signature_bytes).hexdigest()
+    return hashlib.blake2b(signature_bytes, digest_size=16).hexdigest()
+
+
+_signature_cached = functools.lru_cache(maxsize=4096)(_signature_impl)
 
 
 def extract_ip_address(request: HttpRequest) -> str | None:
@@ -232,34 +483,48 @@ def extract_ip_address(request: HttpRequest) -> str | None:
     # Check X-Forwarded-For first
     xff = request.META.get("HTTP_X_FORWARDED_FOR")
     if xff:
-        ip = xff.split(",")[0].strip()
-        try:
-            ip_address(ip)
+        # The client is the first entry; slice it out rather than split the list
+        comma = xff.find(",")
+        ip = _valid_ip((xff if comma < 0 else xff[:comma]).strip())
+        if ip:
             return ip
-        except ValueError:
-            pass
     
     # Check X-Real-IP
     xri = request.META.get("HTTP_X_REAL_IP")
     if xri:
-        try:
-            ip = ip_address(xri.strip())
-            return str(ip)
-        except ValueError:
-            pass
+        ip = _valid_ip(xri.strip())
+        if ip:
+            return ip
     
     # Fallback to REMOTE_ADDR
     addr = request.META.get("REMOTE_ADDR")
     if addr:
-        try:
-            ip = ip_address(addr)
-            return str(ip)
-        except ValueError:
-            pass
+        return _valid_ip(addr)
     
     return None
 
 
+def _valid_ip(value: str) -> str | None:
+    """
+    Validate an IP address string.
+    
+    Dotted-quad IPv4 (the common case) is checked with a regex; anything else
+    goes through ipaddress.ip_address, which also normalizes IPv6.
+    
+    Args:
+        value: The candidate address.
+        
+    Returns:
+        str | None: The address, or None if it is not valid.
+    """
+    if _IPV4_RE.fullmatch(value):
+        return value
+    try:
+        return str(ip_address(value))
+    except ValueError:
+        return None
+
+
 def extract_user_agent(request: HttpRequest) -> str | None:
     """
     Extract the User-Agent header.
@@ -273,23 +538,44 @@ def extract_user_agent(request: HttpRequest) -> str | None:
     return request.META.get("HTTP_USER_AGENT")
 
 
-def resolve_user(request: HttpRequest) -> str | None:
+@functools.lru_cache(maxsize=8)
+def _load_user_callable(path: str) -> Any:
+    """
+    Import the USER_RESOLUTION_CALLABLE once per dotted path.
+    
+    Args:
+        path: Dotted path to the callable.
+        
+    Returns:
+        The imported callable.
+    """
+    return import_string(path)
+
+
+def _on_setting_changed(setting: str, **kwargs: Any) -> None:
+    """Drop the cached user callable when DJANGO_BLACKBOX is overridden."""
+    if setting == "DJANGO_BLACKBOX":
+        _load_user_callable.cache_clear()
+
+
+def resolve_user(request: HttpRequest, *, config: Config | None = None) -> str | None:
     """
     Resolve a user identifier from the request.
     
     Args:
         request: The Django request object.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
         str | None: A string representation of the user, or None.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     
     # Try custom callable first
     if config.USER_RESOLUTION_CALLABLE:
         try:
-            from django.utils.module_loading import import_string
-            func = import_string(config.USER_RESOLUTION_CALLABLE)
+            func = _load_user_callable(config.USER_RESOLUTION_CALLABLE)
             return func(request)
         except Exception as e:
             logger.warning(f"Error calling USER_RESOLUTION_CALLABLE: {e}")
@@ -301,35 +587,105 @@ def resolve_user(request: HttpRequest) -> str | None:
     return None
 
 
-def collect_request_meta(request: HttpRequest) -> dict[str, Any]:
+@functools.lru_cache(maxsize=512)
+def _meta_header_name(meta_key: str) -> tuple[str, str]:
     """
-    Collect rich metadata from the request.
-    Optionally redacts sensitive data based on REDACT_SENSITIVE_DATA setting.
+    Convert a META key such as HTTP_X_REQUEST_ID to its header name.
+    
+    Args:
+        meta_key: The request.META key (starting with HTTP_).
+        
+    Returns:
+        tuple: The title-cased name (X-Request-Id) and its lowercase form.
+    """
+    name = meta_key[5:].replace("_", "-").title()
+    return name, name.lower()
+
+
+def collect_request_headers(request: HttpRequest, *, config: Config | None = None) -> dict[str, Any]:
+    """
+    Collect request headers from META, redacting in the same pass if configured.
     
     Args:
         request: The Django request object.
+        config: Config to use (defaults to get_conf()).
         
     Returns:
-        dict: A dictionary of request metadata (with optional redaction).
+        dict: Header name to value, with sensitive values masked.
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
+    
+    if config.REDACT_SENSITIVE_DATA:
+        redact_keys = config.redact_headers_set
+        mask = config.REDACT_MASK
+    else:
+        redact_keys = frozenset()
+        mask = None
     
-    # Collect headers
     headers = {}
     for key, value in request.META.items():
         if key.startswith("HTTP_"):
-            header_name = key[5:].replace("_", "-").title()
-            headers[header_name] = value
+            name, name_lower = _meta_header_name(key)
+            headers[name] = mask if name_lower in redact_keys else value
+    return headers
+
+
+def body_too_large(request: HttpRequest, *, config: Config | None = None) -> int | None:
+    """
+    Check whether an unread request body is too large to load for a preview.
     
-    # Apply redaction if configured
-    if config.REDACT_SENSITIVE_DATA:
-        headers = redact_headers(headers, config.REDACT_HEADERS, config.REDACT_MASK)
+    Bodies already read by Django are never too large, since reading them
+    again costs nothing. Otherwise the declared CONTENT_LENGTH is compared to
+    BODY_READ_LIMIT_FACTOR times MAX_BODY_BYTES.
+    
+    Args:
+        request: The Django request object.
+        config: Config to use (defaults to get_conf()).
+        
+    Returns:
+        int | None: The declared length if the body should not be read, else None.
+    """
+    if config is None:
+        config = get_conf()
+    
+    if getattr(request, "_body", None) is not None:
+        return None
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except (TypeError, ValueError):
+        return None
+    if length > config.MAX_BODY_BYTES * BODY_READ_LIMIT_FACTOR:
+        return length
+    return None
+
+
+def collect_request_meta(request: HttpRequest, *, config: Config | None = None) -> dict[str, Any]:
+    """
+    Collect rich metadata from the request.
+    Optionally redacts sensitive data based on REDACT_SENSITIVE_DATA setting.
+    
+    Args:
+        request: The Django request object.
+        config: Config to use (defaults to get_conf()).
+        
+    Returns:
+        dict: A dictionary of request metadata (with optional redaction).
+    """
+    if config is None:
+        config = get_conf()
+    
+    headers = collect_request_headers(request, config=config)
     
     # Parse request body if applicable
     body_preview = None
     content_type = request.content_type or request.META.get("CONTENT_TYPE", "")
     
-    if hasattr(request, "body") and content_type in config.STORE_BODY_CONTENT_TYPES:
+    declared_length = body_too_large(request, config=config)
+    if declared_length is not None and content_type in config.STORE_BODY_CONTENT_TYPES:
+        # Do not pull a large upload into memory for a short preview
+        body_preview = f"[Body too large: {declared_length} bytes]"
+    elif hasattr(request, "body") and content_type in config.STORE_BODY_CONTENT_TYPES:
         try:
             body_bytes = request.body
             
@@ -337,7 +693,7 @@ def collect_request_meta(request: HttpRequest) -> dict[str, Any]:
             if config.REDACT_SENSITIVE_DATA:
                 body_preview = redact_body(
                     body_bytes,
-                    config.REDACT_FIELDS,
+                    config.redact_fields_set,
                     config.REDACT_MASK,
                     config.MAX_BODY_BYTES,
                     content_type,
@@ -357,7 +713,7 @@ def collect_request_meta(request: HttpRequest) -> dict[str, Any]:
         "method": request.method,
         "path": request.path,
         "query_string": request.META.get("QUERY_STRING", ""),
-        "user_id": resolve_user(request),
+        "user_id": resolve_user(request, config=config),
         "session_key": getattr(request, "session", {}).session_key if hasattr(request, "session") else None,
         "ip_address": extract_ip_address(request),
         "user_agent": extract_user_agent(request),
@@ -367,14 +723,16 @@ def collect_request_meta(request: HttpRequest) -> dict[str, Any]:
     }
 
 
-def safe_log_to_file(data: dict[str, Any]) -> None:
+def safe_log_to_file(data: dict[str, Any], *, config: Config | None = None) -> None:
     """
     Log incident data to a fallback JSONL file if database write fails.
     
     Args:
         data: The incident data to log.
+        config: Config to use (defaults to get_conf()).
     """
-    config = get_conf()
+    if config is None:
+        config = get_conf()
     if not config.FALLBACK_FILE_LOG:
         return
     
@@ -384,13 +742,15 @@ def safe_log_to_file(data: dict[str, Any]) -> None:
             **data,
         }
         
-        with open(config.FALLBACK_FILE_PATH, "a") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+        from django_blackbox.writer import get_fallback_writer
+        
+        # Appended in batches by a background thread
+        get_fallback_writer(config.FALLBACK_FILE_PATH).write(jsonutils.dumps_bytes(log_entry) + b"\n")
     except Exception as e:
         logger.error(f"Failed to write to fallback log file: {e}")
 
 
-def sanitize_for_json(value: Any) -> Any:
+def sanitize_for_json(value: Any, _cache: dict[int, Any] | None = None) -> Any:
     """
     Recursively convert Python objects into JSON-serializable structures.
     
@@ -400,6 +760,9 @@ def sanitize_for_json(value: Any) -> Any:
     
     Args:
         value: Any Python value to sanitize.
+        _cache: Optional id()-keyed memo shared across calls, so containers that
+            appear in several payloads (e.g. instance_before/instance_after) are
+            only walked once. Only valid while the inputs are kept alive.
         
     Returns:
         JSON-serializable value (str, int, float, bool, None, dict, list).
@@ -414,11 +777,25 @@ def sanitize_for_json(value: Any) -> Any:
     
     # dict → dict
     if isinstance(value, dict):
-        return {sanitize_for_json(k): sanitize_for_json(v) for k, v in value.items()}
+        if _cache is None:
+            _cache = {}
+        hit = _cache.get(id(value))
+        if hit is not None:
+            return hit
+        result = {sanitize_for_json(k, _cache): sanitize_for_json(v, _cache) for k, v in value.items()}
+        _cache[id(value)] = result
+        return result
     
     # list / tuple / set → list
     if isinstance(value, (list, tuple, set)):
-        return [sanitize_for_json(v) for v in value]
+        if _cache is None:
+            _cache = {}
+        hit = _cache.get(id(value))
+        if hit is not None:
+            return hit
+        result = [sanitize_for_json(v, _cache) for v in value]
+        _cache[id(value)] = result
+        return result
     
     # Fallback: best-effort string
     try:
@@ -0,0 +1,404 @@
+"""
+Background writers for RequestActivity rows and the fallback JSONL log.
+
+When ACTIVITY_LOG_ASYNC is enabled, ActivityLoggingMiddleware hands each row
+to a bounded in-process queue instead of inserting it on the request path.
+A daemon thread drains the queue and inserts rows with bulk_create. Incidents
+are still written synchronously, since their ID is needed for the response.
+
+Fallback log lines (written when the database is unavailable) are likewise
+queued and appended in batches by a daemon thread over one long-lived file
+descriptor.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any
+
+from django.db import close_old_connections, connections, router, transaction
+
+from django_blackbox.conf import get_conf
+from django_blackbox.utils import safe_log_to_file
+
+logger = logging.getLogger(__name__)
+
+# Batches at least this large are written with COPY on Postgres (psycopg 3)
+COPY_MIN_ROWS = 256
+
+
+class _BatchWriter:
+    """
+    Queue plus a daemon thread that writes items in batches.
+    
+    Subclasses implement _write(). The worker writes whenever batch_size items
+    are waiting or flush_interval has passed since the first one arrived.
+    """
+    
+    thread_name = "django-blackbox-writer"
+
+    def __init__(self, work_queue: Any, flush_interval: float, batch_size: int):
+        """
+        Initialize the writer; the worker thread starts on first use.
+        
+        Args:
+            work_queue: queue.Queue or queue.SimpleQueue holding pending items.
+            flush_interval: Seconds to wait for a batch to fill before writing.
+            batch_size: Maximum items per write.
+        """
+        self._queue = work_queue
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Items accepted but not yet written, including a batch the worker holds
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+
+    def _submit(self, item: Any) -> bool:
+        """
+        Queue one item without blocking.
+        
+        Args:
+            item: The item to write.
+        
+        Returns:
+            bool: False if the queue was full.
+        """
+        self._ensure_started()
+        with self._pending_cond:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self._done(1)
+            return False
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        Write queued items now and wait for the worker's in-flight batch.
+        
+        Args:
+            timeout: Seconds to wait for the worker's in-flight batch.
+        """
+        batch = self._drain(block=False)
+        while batch:
+            self._write_batch(batch)
+            batch = self._drain(block=False)
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+    def _ensure_started(self) -> None:
+        """Start the worker thread if it is not running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+
+    def _drain(self, block: bool) -> list[Any]:
+        """Collect up to batch_size items, optionally waiting for the first one."""
+        batch = []
+        if block:
+            # Sleep until there is work, then give the batch flush_interval to fill
+            batch.append(self._queue.get())
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            try:
+                if block:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        """Worker loop: write a batch whenever it fills or the interval elapses."""
+        while True:
+            batch = self._drain(block=True)
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch: list[Any]) -> None:
+        """Write a batch and mark its items done."""
+        try:
+            self._write(batch)
+        finally:
+            self._done(len(batch))
+
+    def _done(self, count: int) -> None:
+        """Mark count items as written (or given up on)."""
+        with self._pending_cond:
+            self._pending -= count
+            self._pending_cond.notify_all()
+
+    def _write(self, batch: list[Any]) -> None:
+        """Write one batch; must not raise."""
+        raise NotImplementedError
+
+
+class ActivityWriter(_BatchWriter):
+    """
+    Bounded queue plus a daemon thread that batch-inserts RequestActivity rows.
+    
+    Payloads are dicts of RequestActivity field values; a value may be a
+    zero-argument callable that computes it. When the queue is full the payload
+    is dropped (and counted) rather than blocking the request.
+    """
+    
+    thread_name = "django-blackbox-activity-writer"
+
+    def __init__(self, maxsize: int, flush_interval: float, batch_size: int):
+        """
+        Initialize the writer; the worker thread starts on first use.
+        
+        Args:
+            maxsize: Maximum number of queued rows.
+            flush_interval: Seconds to wait for a batch to fill before writing.
+            batch_size: Maximum rows per bulk insert.
+        """
+        super().__init__(queue.Queue(maxsize=maxsize), flush_interval, batch_size)
+        self.dropped = 0
+
+    def enqueue(self, payload: dict[str, Any]) -> bool:
+        """
+        Queue one RequestActivity payload for writing.
+        
+        Args:
+            payload: RequestActivity field values.
+        
+        Returns:
+            bool: False if the queue was full and the payload was dropped.
+        """
+        if self._submit(payload):
+            return True
+        self.dropped += 1
+        logger.warning(
+            "Activity log queue full; dropped request activity (%d dropped so far)",
+            self.dropped,
+        )
+        return False
+
+    def _write(self, batch: list[dict[str, Any]]) -> None:
+        """Bulk insert a batch, falling back to the JSONL log on failure."""
+        from django_blackbox.models import RequestActivity
+        
+        in_worker = threading.current_thread() is self._thread
+        with self._write_lock:
+            if in_worker:
+                # Long-lived thread: drop connections past CONN_MAX_AGE or broken
+                close_old_connections()
+            try:
+                for row in batch:
+                    # The middleware defers some work (request body, instance
+                    # diff) to here as zero-argument callables
+                    for key, value in row.items():
+                        if callable(value):
+                            row[key] = value()
+                objs = [RequestActivity(**row) for row in batch]
+                if len(objs) < COPY_MIN_ROWS or not _copy_activities(objs):
+                    # ignore_conflicts also skips RETURNING the new primary keys
+                    RequestActivity.objects.bulk_create(objs, batch_size=500, ignore_conflicts=True)
+            except Exception as e:
+                logger.error(f"Failed to persist request activity batch to database: {e}")
+                for row in batch:
+                    safe_log_to_file({
+                        "request_id": row.get("request_id"),
+                        "method": row.get("method"),
+                        "path": row.get("path"),
+                        "http_status": row.get("http_status"),
+                        "persist_error": str(e),
+                    })
+
+
+def _copy_activities(objs: list[Any]) -> bool:
+    """
+    Insert RequestActivity rows with COPY FROM STDIN (Postgres with psycopg 3).
+    
+    COPY skips per-statement parsing and parameter binding, which pays off
+    for large batches of wide JSON rows.
+    
+    Args:
+        objs: Unsaved RequestActivity instances.
+    
+    Returns:
+        bool: False if COPY is unavailable or failed, so the caller should
+            fall back to bulk_create().
+    """
+    from django_blackbox.models import RequestActivity
+    
+    using = router.db_for_write(RequestActivity)
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return False
+    try:
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    except ImportError:
+        return False
+    if not is_psycopg3:
+        return False
+    
+    opts = RequestActivity._meta
+    fields = [f for f in opts.concrete_fields if not f.primary_key]
+    quote = connection.ops.quote_name
+    sql = (
+        f"COPY {quote(opts.db_table)} ({', '.join(quote(f.column) for f in fields)}) FROM STDIN"
+    )
+    try:
+        # Savepoint, so a failed COPY leaves the connection usable for the fallback
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            with cursor.copy(sql) as copy:
+                for obj in objs:
+                    copy.write_row([
+                        f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields
+                    ])
+    except Exception as e:
+        logger.warning(f"COPY of request activity batch failed, falling back to INSERT: {e}")
+        return False
+    return True
+
+
+_writer: ActivityWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def get_activity_writer() -> ActivityWriter:
+    """
+    Get the process-wide activity writer, creating it from settings if needed.
+    
+    Returns:
+        ActivityWriter: The shared writer instance.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_conf()
+                _writer = ActivityWriter(
+                    maxsize=config.ACTIVITY_LOG_QUEUE_SIZE,
+                    flush_interval=config.ACTIVITY_LOG_FLUSH_INTERVAL_MS / 1000,
+                    batch_size=config.ACTIVITY_LOG_FLUSH_BATCH,
+                )
+    return _writer
+
+
+def flush_activity_writer() -> None:
+    """Write any queued activity rows now (used at exit and in tests)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+class FallbackLogWriter(_BatchWriter):
+    """
+    Appends JSONL lines to the fallback log from a daemon thread.
+    
+    Lines are queued by write() and appended in batches with a single
+    os.write() on a descriptor opened with O_APPEND, so concurrent processes
+    sharing the file do not interleave partial lines. The descriptor is
+    reopened after a fork and after reopen() (e.g. following log rotation).
+    """
+    
+    thread_name = "django-blackbox-fallback-log"
+
+    def __init__(self, path: str, flush_interval: float = 0.1, batch_size: int = 64):
+        """
+        Initialize the writer; the file and worker thread are opened on first use.
+        
+        Args:
+            path: Path of the JSONL file.
+            flush_interval: Seconds to wait for a batch to fill before writing.
+            batch_size: Maximum lines per write.
+        """
+        super().__init__(queue.SimpleQueue(), flush_interval, batch_size)
+        self.path = path
+        self._fd: int | None = None
+        self._fd_pid: int | None = None
+
+    def write(self, line: bytes) -> None:
+        """
+        Queue one newline-terminated line for appending.
+        
+        Args:
+            line: The encoded line, including the trailing newline.
+        """
+        self._submit(line)
+
+    def reopen(self) -> None:
+        """Close the descriptor so the next write reopens the path."""
+        with self._write_lock:
+            self._close()
+
+    def _write(self, batch: list[bytes]) -> None:
+        """Append a batch of lines with one write call."""
+        data = b"".join(batch)
+        with self._write_lock:
+            try:
+                if self._fd is None or self._fd_pid != os.getpid():
+                    # A descriptor inherited across fork() is shared with the parent
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    self._fd_pid = os.getpid()
+                view = memoryview(data)
+                while view:
+                    written = os.write(self._fd, view)
+                    view = view[written:]
+            except OSError as e:
+                logger.error(f"Failed to write to fallback log file: {e}")
+                self._close()
+
+    def _close(self) -> None:
+        """Close the descriptor if this process opened it."""
+        if self._fd is not None and self._fd_pid == os.getpid():
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+        self._fd = None
+        self._fd_pid = None
+
+
+_fallback_writers: dict[str, FallbackLogWriter] = {}
+_fallback_lock = threading.Lock()
+
+
+def get_fallback_writer(path: str) -> FallbackLogWriter:
+    """
+    Get the process-wide fallback log writer for a path.
+    
+    Args:
+        path: Path of the JSONL file (FALLBACK_FILE_PATH).
+    
+    Returns:
+        FallbackLogWriter: The shared writer for that path.
+    """
+    writer = _fallback_writers.get(path)
+    if writer is None:
+        with _fallback_lock:
+            writer = _fallback_writers.setdefault(path, FallbackLogWriter(path))
+    return writer
+
+
+def flush_fallback_log() -> None:
+    """Append any queued fallback log lines now (used at exit and in tests)."""
+    for writer in list(_fallback_writers.values()):
+        writer.flush()
+
+
+def reopen_fallback_log() -> None:
+    """Reopen fallback log files on the next write, e.g. from a SIGHUP handler after rotation."""
+    for writer in list(_fallback_writers.values()):
+        writer.reopen()
+
+
+# atexit runs handlers in reverse order: flush activity rows first, since a
+# failed activity write falls back to the JSONL log
+atexit.register(flush_fallback_log)
+atexit.register(flush_activity_writer)
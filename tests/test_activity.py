@@ -6,8 +6,8 @@ from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponse, JsonResponse
-from django.test import RequestFactory, TestCase
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 
 from django_blackbox.activity.decorators import log_request_activity_change
 from django_blackbox.activity.utils import (
@@ -16,8 +16,10 @@ from django_blackbox.activity.utils import (
     set_request_activity_change,
 )
 from django_blackbox.conf import Config, reset_config
-from django_blackbox.middleware import ActivityLoggingMiddleware, RequestIDMiddleware
+from django_blackbox.middleware import ActivityLoggingMiddleware, BodyCaptureMiddleware, RequestIDMiddleware
 from django_blackbox.models import Incident, RequestActivity
+from django_blackbox.utils import request_state
+from django_blackbox.writer import flush_activity_writer
 
 User = get_user_model()
 
@@ -38,6 +40,18 @@ class ActivityUtilsTest(TestCase):
         self.assertIn("username", result)
         self.assertEqual(result["username"], "testuser")
 
+    def test_normalize_instance_model_no_queries(self):
+        """Test that normalizing a model reads loaded fields only, skipping many-to-many."""
+        user = User.objects.create_user(username="testuser", email="test@example.com")
+        user = User.objects.only("username").get(pk=user.pk)
+        
+        with self.assertNumQueries(0):
+            result = normalize_instance(user)
+        
+        self.assertEqual(result["username"], "testuser")
+        self.assertNotIn("email", result)
+        self.assertNotIn("groups", result)
+
     def test_compute_diff(self):
         """Test computing diff between two states."""
         before = {"name": "old", "value": 1}
@@ -47,6 +61,31 @@ class ActivityUtilsTest(TestCase):
         self.assertEqual(diff["name"], ["old", "new"])
         self.assertIn("new_field", diff)
         self.assertEqual(diff["new_field"], [None, "added"])
+        self.assertNotIn("value", diff)
+
+    def test_content_type_cached(self):
+        """Test that content_type_for caches per model and resets after migrate."""
+        from django_blackbox.activity_tracking import _clear_content_type_cache, content_type_for
+        
+        ContentType.objects.clear_cache()
+        _clear_content_type_cache(sender=None)
+        content_type = content_type_for(User)
+        ContentType.objects.clear_cache()
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(content_type_for(User), content_type)
+        
+        _clear_content_type_cache(sender=None)
+        with self.assertNumQueries(1):
+            content_type_for(User)
+
+    def test_compute_diff_unchanged(self):
+        """Test that equal states, and keys missing on one side as None, give no diff."""
+        state = {"name": "same", "value": 1}
+        self.assertEqual(compute_diff(state, state), {})
+        self.assertEqual(compute_diff(state, dict(state)), {})
+        self.assertEqual(compute_diff({"gone": None}, {}), {})
+        self.assertEqual(compute_diff({}, {"gone": None}), {})
 
     def test_set_request_activity_change(self):
         """Test setting activity change context on request."""
@@ -167,9 +206,6 @@ class ActivityLoggingMiddlewareTest(TestCase):
             config = Config()
             config.ACTIVITY_LOG_ENABLED = True
             config.ACTIVITY_LOG_IGNORE_PATHS = [r"^/health/", r"^/metrics"]
-            config._compiled_activity_ignore_paths = [
-                __import__("re").compile(p) for p in config.ACTIVITY_LOG_IGNORE_PATHS
-            ]
             mock_conf.return_value = config
             
             request = self.factory.get("/health/check")
@@ -240,7 +276,7 @@ class ActivityLoggingMiddlewareTest(TestCase):
             dedup_hash="test_hash",
         )
         
-        request._django_blackbox_incident_created = True
+        request_state(request)["incident_created"] = True
         
         def get_response(req):
             return HttpResponse(status=500)
@@ -248,8 +284,9 @@ class ActivityLoggingMiddlewareTest(TestCase):
         middleware = ActivityLoggingMiddleware(get_response)
         middleware(request)
         
-        activity = RequestActivity.objects.first()
-        self.assertEqual(activity.incident, incident)
+        activity = RequestActivity.objects.with_related().first()
+        with self.assertNumQueries(0):
+            self.assertEqual(activity.incident, incident)
 
     def test_request_response_data_captured(self):
         """Test that request and response data is captured."""
@@ -299,6 +336,113 @@ class ActivityLoggingMiddlewareTest(TestCase):
         self.assertIn("name", activity.instance_diff)
         self.assertEqual(activity.instance_diff["name"], ["old", "new"])
 
+    def test_custom_action_keeps_tracked_diff(self):
+        """Test that a context without instances falls back to the signal-tracked diff."""
+        request = self.factory.put("/users/1")
+        set_request_activity_change(request, custom_action="profile_touched")
+        tracked = ({"name": "old"}, {"name": "new"}, {"name": {"before": "old", "after": "new"}})
+        
+        with patch("django_blackbox.activity_tracking.get_tracked_change_for", return_value=tracked):
+            self.get_middleware()(request)
+        
+        activity = RequestActivity.objects.get()
+        self.assertEqual(activity.custom_action, "profile_touched")
+        self.assertEqual(activity.instance_diff, {"name": {"before": "old", "after": "new"}})
+
+    def test_instance_diff_compares_unsanitized_values(self):
+        """Test that equal values which serialize differently are not reported as changed."""
+        from datetime import datetime, timedelta, timezone
+        
+        joined = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        before = User(username="u", date_joined=joined)
+        # The same instant in another zone: equal, but a different isoformat()
+        after = User(username="u", date_joined=joined.astimezone(timezone(timedelta(hours=5, minutes=30))))
+        request = self.factory.put("/users/1")
+        set_request_activity_change(request, instance_before=before, instance_after=after)
+        
+        self.get_middleware()(request)
+        
+        self.assertEqual(RequestActivity.objects.get().instance_diff, {})
+
+    def test_latest_for_request(self):
+        """Test that latest_for_request returns the newest activity for a request ID."""
+        from datetime import timedelta
+        
+        from django.utils import timezone
+        
+        older = RequestActivity.objects.create(method="GET", path="/a", http_status=200, request_id="rid")
+        newer = RequestActivity.objects.create(method="GET", path="/b", http_status=200, request_id="rid")
+        RequestActivity.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        
+        self.assertEqual(RequestActivity.objects.latest_for_request("rid"), newer)
+        self.assertIsNone(RequestActivity.objects.latest_for_request("other"))
+
+    def test_request_id_without_request_id_middleware(self):
+        """Test that the activity middleware assigns a request ID on its own."""
+        request = self.factory.get("/test", HTTP_X_REQUEST_ID="abc123")
+        
+        self.get_middleware()(request)
+        
+        self.assertEqual(request.django_blackbox_request_id, "abc123")
+        self.assertEqual(RequestActivity.objects.get().request_id, "abc123")
+
+    @override_settings(DJANGO_BLACKBOX={"ACTIVITY_LOG_ASYNC": True})
+    def test_async_activity_written_on_flush(self):
+        """Test that async mode queues the row instead of inserting inline."""
+        request = self.factory.get("/test")
+        RequestIDMiddleware(lambda req: HttpResponse()).process_request(request)
+        
+        middleware = self.get_middleware()
+        with patch("django_blackbox.writer.ActivityWriter._ensure_started"):
+            middleware(request)
+            self.assertEqual(RequestActivity.objects.count(), 0)
+            flush_activity_writer()
+        
+        self.assertEqual(RequestActivity.objects.count(), 1)
+        self.assertEqual(RequestActivity.objects.first().path, "/test")
+
+    def test_large_batch_falls_back_to_bulk_create(self):
+        """Test that batches past the COPY threshold still insert without Postgres."""
+        from django_blackbox.writer import ActivityWriter
+        
+        writer = ActivityWriter(maxsize=10, flush_interval=0.1, batch_size=10)
+        rows = [{"method": "GET", "path": f"/copy/{i}", "http_status": 200} for i in range(3)]
+        with patch("django_blackbox.writer.COPY_MIN_ROWS", 2):
+            writer._write(rows)
+        
+        self.assertEqual(RequestActivity.objects.filter(path__startswith="/copy/").count(), 3)
+
+    @override_settings(DJANGO_BLACKBOX={"ACTIVITY_LOG_ASYNC": True})
+    def test_async_request_body_rendered_by_writer(self):
+        """Test that async mode parses and redacts the request body in the writer."""
+        request = self.factory.post(
+            "/login", data='{"username": "u", "password": "secret"}', content_type="application/json"
+        )
+        RequestIDMiddleware(lambda req: HttpResponse()).process_request(request)
+        
+        middleware = BodyCaptureMiddleware(self.get_middleware())
+        with patch("django_blackbox.writer.ActivityWriter._ensure_started"):
+            middleware(request)
+            flush_activity_writer()
+        
+        body = json.loads(RequestActivity.objects.get().request_body)
+        self.assertEqual(body["body"]["username"], "u")
+        self.assertEqual(body["body"]["password"], "[REDACTED]")
+
+    @override_settings(DJANGO_BLACKBOX={"ACTIVITY_LOG_ASYNC": True})
+    def test_async_instance_diff_computed_by_writer(self):
+        """Test that async mode diffs set_request_activity_change states in the writer."""
+        request = self.factory.put("/users/1")
+        set_request_activity_change(
+            request, instance_before={"name": "old"}, instance_after={"name": "new"}
+        )
+        
+        with patch("django_blackbox.writer.ActivityWriter._ensure_started"):
+            self.get_middleware()(request)
+            flush_activity_writer()
+        
+        self.assertEqual(RequestActivity.objects.get().instance_diff, {"name": ["old", "new"]})
+
     def test_error_handling_does_not_break_response(self):
         """Test that logging errors don't break the response."""
         request = self.factory.get("/test")
@@ -403,6 +547,25 @@ class ActivityDecoratorTest(TestCase):
         # Request body should include body data if present
         self.assertIn("foo", activity.request_body)
 
+    def test_querydict_body_same_with_either_json_backend(self):
+        """Test that a QueryDict body (DRF form data) is stored the same with and without orjson."""
+        from django.http import QueryDict
+        
+        from django_blackbox import jsonutils
+        
+        request = self.factory.post("/test")
+        request.data = QueryDict("a=1&b=2&b=3&password=secret")
+        middleware = ActivityLoggingMiddleware(lambda req: HttpResponse())
+        config = Config(REDACT_MASK="***")
+        
+        bodies = []
+        for has_orjson in (jsonutils.HAS_ORJSON, False):
+            with patch.object(jsonutils, "HAS_ORJSON", has_orjson):
+                bodies.append(json.loads(middleware._build_request_body(request, "POST", config)))
+        
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertEqual(bodies[0]["body"], {"a": "1", "b": ["2", "3"], "password": "***"})
+
     def test_response_body_logged(self):
         """Test that response body is logged."""
         request = self.factory.post("/test")
@@ -419,6 +582,42 @@ class ActivityDecoratorTest(TestCase):
         self.assertIn("Invalid department", activity.response_body)
         self.assertIn("detail", activity.response_body)
 
+    def test_rendered_drf_response_body_uses_content(self):
+        """Test that rendered DRF responses are logged from their content."""
+        from rest_framework.renderers import JSONRenderer
+        from rest_framework.response import Response
+        
+        request = self.factory.get("/api/items")
+        RequestIDMiddleware(lambda req: HttpResponse()).process_request(request)
+        
+        def get_response(req):
+            response = Response({"items": [1, 2]})
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = "application/json"
+            response.renderer_context = {}
+            return response.render()
+        
+        middleware = ActivityLoggingMiddleware(get_response)
+        middleware(request)
+        
+        activity = RequestActivity.objects.first()
+        self.assertEqual(activity.response_body, '{"items":[1,2]}')
+
+    def test_streaming_response_body_not_consumed(self):
+        """Test that streaming responses are not drained for logging."""
+        request = self.factory.get("/download")
+        RequestIDMiddleware(lambda req: HttpResponse()).process_request(request)
+        
+        def get_response(req):
+            return StreamingHttpResponse(iter([b"chunk-1", b"chunk-2"]))
+        
+        middleware = ActivityLoggingMiddleware(get_response)
+        response = middleware(request)
+        
+        activity = RequestActivity.objects.first()
+        self.assertEqual(activity.response_body, "<streaming response omitted>")
+        self.assertEqual(b"".join(response.streaming_content), b"chunk-1chunk-2")
+
     def test_request_body_with_empty_data(self):
         """Test that request body is logged even when request.data is empty dict."""
         request = self.factory.post(
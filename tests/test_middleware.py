@@ -4,7 +4,7 @@ Tests for middleware components.
 from unittest.mock import patch
 
 from django.http import HttpResponse
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, TestCase, override_settings
 
 from django_blackbox.conf import Config, reset_config
 from django_blackbox.middleware import Capture5xxMiddleware, RequestIDMiddleware
@@ -48,6 +48,16 @@ class RequestIDMiddlewareTest(TestCase):
         
         self.assertIn("X-Request-ID", response)
 
+    def test_response_header_follows_settings_override(self):
+        """Test that the bound config is refreshed when settings change."""
+        request = self.factory.get("/")
+        
+        with override_settings(DJANGO_BLACKBOX={"ADD_REQUEST_ID_HEADER": False}):
+            self.middleware.process_request(request)
+            response = self.middleware.process_response(request, HttpResponse())
+        
+        self.assertNotIn("X-Request-ID", response)
+
 
 class Capture5xxMiddlewareTest(TestCase):
     """Test Capture5xxMiddleware."""
@@ -101,8 +111,45 @@ class MiddlewareIntegrationTest(TestCase):
         incidents = Incident.objects.all()
         self.assertGreater(incidents.count(), 0)
 
+    def test_large_json_error_body_parsed(self):
+        """Test that a JSON 5xx body larger than MAX_BODY_BYTES still yields its message."""
+        from django.http import JsonResponse
+        
+        from django_blackbox.services import log_5xx_response_and_decorate
+        
+        request = self.factory.get("/test")
+        stacktrace = "Traceback (most recent call last):\n" + "  File \"app.py\", line 1\n" * 120
+        response = JsonResponse({"detail": "Payment gateway timed out", "stacktrace": stacktrace}, status=500)
+        self.assertGreater(len(response.content), 3000)
+        
+        log_5xx_response_and_decorate(request, response)
+        
+        incident = Incident.objects.get()
+        self.assertEqual(incident.exception_message, "Payment gateway timed out")
+        self.assertEqual(incident.stacktrace, stacktrace)
+
 
 def get_response(request):
     """Dummy view."""
     return HttpResponse("OK")
 
+
+
+class ErrorResponseTest(TestCase):
+    """Test the JSON error response body."""
+
+    def test_custom_error_format_placeholder(self):
+        """Test that <incident_id> is filled in string values of CUSTOM_ERROR_FORMAT."""
+        import json
+        from django_blackbox.services import _json_500
+        
+        error_format = {"error": "Reference <incident_id>", "code": 42}
+        with override_settings(DJANGO_BLACKBOX={"CUSTOM_ERROR_FORMAT": error_format}):
+            response = _json_500("ignored", "INCIDENT-0007")
+        
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(
+            json.loads(response.content),
+            {"error": "Reference INCIDENT-0007", "code": 42, "incident_id": "INCIDENT-0007"},
+        )
+        self.assertEqual(error_format["error"], "Reference <incident_id>")
@@ -2,11 +2,14 @@
 Tests for Incident model.
 """
 from datetime import timedelta
+from io import StringIO
 
-from django.test import TestCase
+from django.core.management import call_command
+
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from django_blackbox.models import Incident
+from django_blackbox.models import Incident, IncidentCounter, flush_dedup_cache
 
 
 class IncidentModelTest(TestCase):
@@ -130,6 +133,46 @@ class IncidentModelTest(TestCase):
         
         self.assertIsNotNone(incident.resolved_at)
 
+    def test_resolved_at_saved_with_status_update_fields(self):
+        """Test that resolved_at is persisted when saving only the status field."""
+        incident = Incident.objects.create(
+            request_id=self.request_id,
+            incident_id=self.incident_id,
+            status=Incident.Status.OPEN,
+            http_status=500,
+            method="GET",
+            path="/test",
+            dedup_hash="abc123",
+        )
+        
+        incident.status = Incident.Status.RESOLVED
+        incident.save(update_fields=["status"])
+        
+        self.assertIsNotNone(Incident.objects.get(pk=incident.pk).resolved_at)
+
+    def test_bulk_resolve(self):
+        """Test that bulk_resolve resolves many incidents in one UPDATE."""
+        incidents = [
+            Incident.objects.create(
+                request_id=self.request_id,
+                incident_id=f"INCIDENT-BULK-{i}",
+                status=Incident.Status.OPEN,
+                http_status=500,
+                method="GET",
+                path="/test",
+                dedup_hash="abc123",
+            )
+            for i in range(3)
+        ]
+        
+        with self.assertNumQueries(1):
+            resolved = Incident.objects.bulk_resolve([incident.pk for incident in incidents])
+        
+        self.assertEqual(resolved, 3)
+        for incident in Incident.objects.filter(pk__in=[i.pk for i in incidents]):
+            self.assertEqual(incident.status, Incident.Status.RESOLVED)
+            self.assertIsNotNone(incident.resolved_at)
+
     def test_string_representation(self):
         """Test string representation of incident."""
         import uuid
@@ -147,3 +190,193 @@ class IncidentModelTest(TestCase):
         self.assertIn("/test", str(incident))
         self.assertIn("OPEN", str(incident))
 
+
+
+class LazyStacktraceTest(TestCase):
+    """Test that a stacktrace callable is only evaluated for new incidents."""
+
+    def test_stacktrace_callable_called_on_create_only(self):
+        """Test that dedup hits do not format the stacktrace."""
+        import uuid
+        calls = []
+        
+        def stacktrace():
+            calls.append(1)
+            return "Traceback (most recent call last): ..."
+        
+        defaults = {
+            "request_id": uuid.uuid4(),
+            "status": Incident.Status.OPEN,
+            "http_status": 500,
+            "method": "GET",
+            "path": "/lazy",
+            "dedup_hash": "lazy_signature",
+            "stacktrace": stacktrace,
+        }
+        
+        incident, created = Incident.objects.create_or_increment("lazy_signature", defaults)
+        _, created_again = Incident.objects.create_or_increment("lazy_signature", defaults)
+        
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(Incident.objects.get(pk=incident.pk).stacktrace, "Traceback (most recent call last): ...")
+
+
+class ModelRegistrationTest(TestCase):
+    """Test that models are defined once, in django_blackbox.models."""
+
+    def test_models_defined_in_models_module(self):
+        """Test that the registered models come from the single models module."""
+        from django.apps import apps
+        
+        for model in apps.get_app_config("django_blackbox").get_models():
+            self.assertEqual(model.__module__, "django_blackbox.models")
+
+    @override_settings(MIGRATION_MODULES={})
+    def test_no_missing_migrations(self):
+        """Test that the migrations match the models on the current database engine."""
+        out = StringIO()
+        try:
+            call_command("makemigrations", "django_blackbox", check=True, dry_run=True, stdout=out)
+        except SystemExit:
+            self.fail(f"Missing migrations for django_blackbox:\n{out.getvalue()}")
+
+
+class IncidentCounterTest(TestCase):
+    """Test sequential incident ID allocation."""
+
+    def test_generate_incident_id_is_sequential(self):
+        """Test that generated IDs increase by one."""
+        self.assertEqual(Incident.generate_incident_id(), "INCIDENT-0001")
+        self.assertEqual(Incident.generate_incident_id(), "INCIDENT-0002")
+
+    def test_counter_seeded_from_existing_incidents(self):
+        """Test that a missing counter row starts after the highest existing ID."""
+        import uuid
+        # Migration 0003 seeds the row; remove it to exercise the lazy path
+        IncidentCounter.objects.all().delete()
+        Incident.objects.create(
+            request_id=uuid.uuid4(),
+            incident_id="INCIDENT-0041",
+            http_status=500,
+            method="GET",
+            path="/test",
+            dedup_hash="abc123",
+        )
+        
+        self.assertEqual(Incident.generate_incident_id(), "INCIDENT-0042")
+        self.assertEqual(IncidentCounter.objects.get(pk=1).next_num, 43)
+
+
+class JSONFieldTest(TestCase):
+    """Test the JSONField used for header and payload snapshots."""
+
+    def test_round_trip(self):
+        """Test that nested and non-ASCII values survive save and load."""
+        import uuid
+        headers = {"X-Name": "caf\u00e9", "X-List": [1, 2.5, None, True], "X-Nested": {"a": {}}}
+        incident = Incident.objects.create(
+            request_id=uuid.uuid4(),
+            incident_id="INCIDENT-0001",
+            http_status=500,
+            method="GET",
+            path="/test",
+            headers=headers,
+            dedup_hash="abc123",
+        )
+        
+        self.assertEqual(Incident.objects.get(pk=incident.pk).headers, headers)
+
+
+@override_settings(DJANGO_BLACKBOX={"DEDUP_COALESCE_SECONDS": 60})
+class DedupCoalescingTest(TestCase):
+    """Test in-process coalescing of repeated signatures."""
+
+    def tearDown(self):
+        """Drop cached entries so other tests start clean."""
+        flush_dedup_cache()
+
+    def test_repeated_signature_coalesced_until_flush(self):
+        """Test that bursts hit the database once and are flushed as one update."""
+        import uuid
+        defaults = {
+            "request_id": uuid.uuid4(),
+            "status": Incident.Status.OPEN,
+            "http_status": 500,
+            "method": "GET",
+            "path": "/burst",
+            "dedup_hash": "burst_signature",
+        }
+        
+        first, created = Incident.objects.create_or_increment("burst_signature", defaults)
+        with self.assertNumQueries(0):
+            second, created_again = Incident.objects.create_or_increment("burst_signature", defaults)
+            Incident.objects.create_or_increment("burst_signature", defaults)
+        
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Incident.objects.get(pk=first.pk).occurrence_count, 1)
+        
+        flush_dedup_cache()
+        self.assertEqual(Incident.objects.get(pk=first.pk).occurrence_count, 3)
+
+    def test_coalesced_hit_skips_request_metadata(self):
+        """Test that a coalesced repeat does not collect request metadata."""
+        from unittest.mock import patch
+        
+        from django.test import RequestFactory
+        
+        from django_blackbox.services import log_exception_and_build_response
+        from django_blackbox.utils import collect_request_meta
+        
+        factory = RequestFactory()
+        log_exception_and_build_response(factory.get("/burst"), ValueError("boom"))
+        
+        with patch("django_blackbox.services.collect_request_meta", wraps=collect_request_meta) as collect:
+            log_exception_and_build_response(factory.get("/burst"), ValueError("boom"))
+        
+        collect.assert_not_called()
+        flush_dedup_cache()
+        self.assertEqual(Incident.objects.get(path="/burst").occurrence_count, 2)
+
+    def _defaults(self, path):
+        """Incident defaults for create_or_increment."""
+        import uuid
+        return {
+            "request_id": uuid.uuid4(),
+            "status": Incident.Status.OPEN,
+            "http_status": 500,
+            "method": "GET",
+            "path": path,
+            "dedup_hash": path,
+        }
+
+    def test_quiet_signature_flushed_by_other_signature(self):
+        """Test that a signature that stops firing is written when another one arrives."""
+        import time
+        from unittest.mock import patch
+        
+        quiet, _ = Incident.objects.create_or_increment("quiet", self._defaults("/quiet"))
+        Incident.objects.create_or_increment("quiet", self._defaults("/quiet"))
+        
+        with patch("django_blackbox.models.time.monotonic", return_value=time.monotonic() + 61):
+            Incident.objects.create_or_increment("other", self._defaults("/other"))
+        
+        self.assertEqual(Incident.objects.get(pk=quiet.pk).occurrence_count, 2)
+
+    def test_quiet_signature_flushed_by_sweep(self):
+        """Test that the periodic sweep writes counts of expired signatures."""
+        import time
+        from unittest.mock import patch
+        
+        from django_blackbox.models import _sweep_expired
+        
+        quiet, _ = Incident.objects.create_or_increment("quiet", self._defaults("/quiet"))
+        Incident.objects.create_or_increment("quiet", self._defaults("/quiet"))
+        
+        with patch("django_blackbox.models.time.monotonic", return_value=time.monotonic() + 61):
+            _sweep_expired()
+        
+        self.assertEqual(Incident.objects.get(pk=quiet.pk).occurrence_count, 2)
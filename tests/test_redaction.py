@@ -1,12 +1,14 @@
 """
 Tests for redaction and data privacy features.
 """
-from django.test import TestCase
+import io
 
-from django_blackbox.utils import redact_body, redact_headers
+from django.test import SimpleTestCase
 
+from django_blackbox.utils import redact_body, redact_body_to_stream, redact_headers
 
-class RedactionTest(TestCase):
+
+class RedactionTest(SimpleTestCase):
     """Test redaction utilities."""
 
     def test_redact_nested_json(self):
@@ -97,3 +99,83 @@ class RedactionTest(TestCase):
         # Should be truncated
         self.assertLessEqual(len(redacted.encode("utf-8")), 100 + len("..."))
 
+
+    def test_json_bytes_without_fields_not_reparsed(self):
+        """Test that JSON bytes without any field name are stored as-is."""
+        body = b'{"name": "visible", "count": 2}'
+        
+        redacted = redact_body(body, ["password"], "[REDACTED]", 2048, "application/json")
+        
+        self.assertEqual(redacted, body.decode("utf-8"))
+
+    def test_json_bytes_with_escaped_field_name_redacted(self):
+        """Test that a field name spelled with a JSON escape is still redacted."""
+        body = b'{"pass\\u0077ord": "secret123"}'
+        
+        redacted = redact_body(body, ["password"], "[REDACTED]", 2048, "application/json")
+        
+        self.assertNotIn("secret123", redacted)
+        self.assertIn("[REDACTED]", redacted)
+
+    def test_redact_does_not_modify_input(self):
+        """Test that redaction works on a copy of nested containers."""
+        body = {"items": [{"password": "secret123"}], "auth": {"token": "abc123"}}
+        
+        redacted = redact_body(body, ["password", "token"], "[REDACTED]", 2048, "application/json")
+        
+        self.assertNotIn("secret123", redacted)
+        self.assertNotIn("abc123", redacted)
+        self.assertEqual(body["items"][0]["password"], "secret123")
+        self.assertEqual(body["auth"]["token"], "abc123")
+
+    def test_config_redact_sets(self):
+        """Test that the precomputed config sets redact case-insensitively."""
+        from django_blackbox.conf import Config
+        
+        config = Config(REDACT_HEADERS=["Authorization"], REDACT_FIELDS=["Password"])
+        
+        headers = redact_headers({"AUTHORIZATION": "Bearer abc"}, config.redact_headers_set, "[REDACTED]")
+        body = redact_body({"password": "secret123"}, config.redact_fields_set, "[REDACTED]", 2048, "application/json")
+        
+        self.assertEqual(headers["AUTHORIZATION"], "[REDACTED]")
+        self.assertNotIn("secret123", body)
+
+    def test_redact_body_to_stream(self):
+        """Test streaming redaction writes truncated, redacted JSON."""
+        body = b'{"password": "secret123", "data": "' + b"x" * 5000 + b'"}'
+        buf = io.BytesIO()
+        
+        written = redact_body_to_stream(body, buf, ["password"], "[REDACTED]", 100, "application/json")
+        
+        output = buf.getvalue()
+        self.assertEqual(written, len(output))
+        self.assertLessEqual(len(output), 100 + len("..."))
+        self.assertIn(b"[REDACTED]", output)
+        self.assertNotIn(b"secret123", output)
+
+    def test_large_json_truncated_while_encoding(self):
+        """Test that a JSON body much larger than max_bytes is still redacted and capped."""
+        body = '{"password": "secret123", "items": [' + ", ".join(["1"] * 5000) + "]}"
+        
+        redacted = redact_body(body, ["password"], "[REDACTED]", 100, "application/json")
+        
+        self.assertTrue(redacted.startswith('{"password":"[REDACTED]","items":[1,1'))
+        self.assertTrue(redacted.endswith("..."))
+        self.assertLessEqual(len(redacted.encode("utf-8")), 100 + len("..."))
+
+    def test_json_bytes_with_non_ascii_field_case_redacted(self):
+        """Test that a non-ASCII field name in a different case is still redacted."""
+        body = '{"PÄSSWORD": "hunter2"}'.encode("utf-8")
+        
+        redacted = redact_body(body, ["pässword"], "***", 2048, "application/json")
+        
+        self.assertNotIn("hunter2", redacted)
+        self.assertIn("***", redacted)
+
+    def test_json_bytes_with_key_casefolding_to_field_redacted(self):
+        """Test that a non-ASCII key that casefolds to an ASCII field is redacted."""
+        body = '{"paßword": "hunter2"}'.encode("utf-8")
+        
+        redacted = redact_body(body, ["password"], "***", 2048, "application/json")
+        
+        self.assertNotIn("hunter2", redacted)
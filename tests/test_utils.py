@@ -1,18 +1,28 @@
 """
 Tests for utility functions.
 """
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 
 from django_blackbox.utils import (
+    collect_request_meta,
     compute_signature,
     extract_ip_address,
     normalize_message,
     redact_body,
     redact_headers,
+    resolve_user,
+    safe_log_to_file,
+    sanitize_for_json,
 )
+from django_blackbox.writer import flush_fallback_log
 
 
-class RedactionTest(TestCase):
+def resolve_header_user(request):
+    """USER_RESOLUTION_CALLABLE used by UserResolutionTest."""
+    return request.META.get("HTTP_X_USER")
+
+
+class RedactionTest(SimpleTestCase):
     """Test redaction utilities."""
 
     def test_redact_headers(self):
@@ -33,6 +43,14 @@ class RedactionTest(TestCase):
         self.assertEqual(redacted["X-API-Key"], "[REDACTED]")
         self.assertEqual(redacted["Content-Type"], "application/json")
 
+    def test_redact_headers_from_pairs(self):
+        """Test redacting headers given as (name, value) pairs."""
+        pairs = (("Authorization", "Bearer secret"), ("Accept", "*/*"))
+        
+        redacted = redact_headers(pairs, ["authorization"], "***")
+        
+        self.assertEqual(redacted, {"Authorization": "***", "Accept": "*/*"})
+
     def test_redact_body_dict(self):
         """Test redacting dict body."""
         body = {
@@ -75,7 +93,7 @@ class RedactionTest(TestCase):
         self.assertIn("[REDACTED]", redacted)
 
 
-class NormalizationTest(TestCase):
+class NormalizationTest(SimpleTestCase):
     """Test message normalization."""
 
     def test_normalize_uuid(self):
@@ -117,13 +135,18 @@ class NormalizationTest(TestCase):
         )
         self.assertNotEqual(signature1, signature3)
 
+    def test_signature_hash_setting(self):
+        """Test that SIGNATURE_HASH selects the digest."""
+        self.assertEqual(len(compute_signature("ValueError", "/test", "boom")), 32)
+        
+        with override_settings(DJANGO_BLACKBOX={"SIGNATURE_HASH": "sha256"}):
+            self.assertEqual(len(compute_signature("ValueError", "/test", "boom")), 64)
+
 
-class IPExtractionTest(TestCase):
+class IPExtractionTest(SimpleTestCase):
     """Test IP address extraction."""
 
-    def setUp(self):
-        """Set up test."""
-        self.factory = RequestFactory()
+    factory = RequestFactory()
 
     def test_extract_from_x_forwarded_for(self):
         """Test extracting IP from X-Forwarded-For."""
@@ -143,3 +166,101 @@ class IPExtractionTest(TestCase):
         ip = extract_ip_address(request)
         self.assertEqual(ip, "192.168.1.1")
 
+
+class UserResolutionTest(TestCase):
+    """Test user resolution."""
+
+    def test_custom_callable_follows_settings(self):
+        """Test that the cached callable is dropped when settings change."""
+        request = RequestFactory().get("/", HTTP_X_USER="alice")
+        
+        with override_settings(DJANGO_BLACKBOX={"USER_RESOLUTION_CALLABLE": "tests.test_utils.resolve_header_user"}):
+            self.assertEqual(resolve_user(request), "alice")
+            self.assertEqual(resolve_user(request), "alice")
+        
+        with override_settings(DJANGO_BLACKBOX={"USER_RESOLUTION_CALLABLE": "tests.test_utils.missing"}):
+            self.assertIsNone(resolve_user(request))
+
+class RequestMetaTest(TestCase):
+    """Test request metadata collection."""
+
+    @override_settings(DJANGO_BLACKBOX={"MAX_BODY_BYTES": 16})
+    def test_large_unread_body_not_loaded(self):
+        """Test that an unread body far above MAX_BODY_BYTES is summarized, not read."""
+        body = b'{"data": "' + b"x" * 1000 + b'"}'
+        request = RequestFactory().post("/upload", data=body, content_type="application/json")
+        
+        meta = collect_request_meta(request)
+        
+        self.assertEqual(meta["body_preview"], f"[Body too large: {len(body)} bytes]")
+        self.assertFalse(hasattr(request, "_body"))
+
+
+class IgnorePathsTest(TestCase):
+    """Test combined ignore-path patterns."""
+
+    def test_patterns_combined(self):
+        """Test that any one pattern matching ignores the path."""
+        from django_blackbox.conf import Config
+        
+        config = Config(ACTIVITY_LOG_IGNORE_PATHS=[r"^/health/", r"/metrics$"])
+        
+        self.assertTrue(config.activity_ignore_paths_re.search("/health/live"))
+        self.assertTrue(config.activity_ignore_paths_re.search("/internal/metrics"))
+        self.assertIsNone(config.activity_ignore_paths_re.search("/api/users"))
+        self.assertIsNone(config.ignore_paths_re)
+
+
+class FallbackLogTest(TestCase):
+    """Test the fallback JSONL log."""
+
+    def test_lines_appended_on_flush(self):
+        """Test that queued lines are written as one JSON object per line."""
+        import json
+        import os
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fallback.log")
+            with override_settings(DJANGO_BLACKBOX={"FALLBACK_FILE_PATH": path}):
+                safe_log_to_file({"request_id": "a", "path": "/one"})
+                safe_log_to_file({"request_id": "b", "path": "/two"})
+                flush_fallback_log()
+            
+            with open(path, "rb") as f:
+                entries = [json.loads(line) for line in f]
+        
+        self.assertEqual([e["path"] for e in entries], ["/one", "/two"])
+
+    def test_idle_worker_waits_for_first_item(self):
+        """Test that a blocking drain waits for work instead of waking every flush_interval."""
+        import threading
+        
+        from django_blackbox.writer import FallbackLogWriter
+        
+        writer = FallbackLogWriter("unused.log", flush_interval=0.01)
+        threading.Timer(0.1, writer._queue.put, args=(b"line\n",)).start()
+        
+        self.assertEqual(writer._drain(block=True), [b"line\n"])
+
+
+class SanitizeForJSONTest(TestCase):
+    """Test JSON sanitization."""
+
+    def test_sanitize_converts_uuid(self):
+        """Test that non-JSON values are stringified."""
+        import uuid
+        
+        value = uuid.uuid4()
+        self.assertEqual(sanitize_for_json({"id": value}), {"id": str(value)})
+
+    def test_sanitize_shared_cache_reuses_subtrees(self):
+        """Test that a shared cache sanitizes repeated containers once."""
+        shared = {"name": "widget", "tags": ["a", "b"]}
+        cache = {}
+        
+        before = sanitize_for_json({"item": shared}, cache)
+        after = sanitize_for_json({"item": shared, "count": 2}, cache)
+        
+        self.assertEqual(before, {"item": {"name": "widget", "tags": ["a", "b"]}})
+        self.assertIs(before["item"], after["item"])